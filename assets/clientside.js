@@ -0,0 +1,95 @@
+// Clientside callbacks for the interactions that only pick, show, hide or
+// filter data shipped with the page (see app.py), so they never reach the server.
+(function () {
+    var TYPED_ARRAYS = {
+        i1: Int8Array, u1: Uint8Array, u1c: Uint8ClampedArray, i2: Int16Array, u2: Uint16Array,
+        i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+    };
+
+    // Plotly sends numeric arrays base64-encoded as {dtype, bdata}
+    function decode(values) {
+        if (!values || Array.isArray(values) || values.bdata === undefined) {
+            return values;
+        }
+        var bytes = Uint8Array.from(atob(values.bdata), function (c) { return c.charCodeAt(0); });
+        return Array.from(new TYPED_ARRAYS[values.dtype](bytes.buffer));
+    }
+
+    function filterTrace(trace, keep) {
+        var filtered = Object.assign({}, trace);
+        ['x', 'y', 'text', 'hovertext', 'customdata'].forEach(function (key) {
+            var values = decode(trace[key]);
+            if (Array.isArray(values) && values.length === keep.length) {
+                filtered[key] = values.filter(function (_, i) { return keep[i]; });
+            }
+        });
+        if (trace.marker) {
+            var colors = decode(trace.marker.color);
+            if (Array.isArray(colors) && colors.length === keep.length) {
+                filtered.marker = Object.assign({}, trace.marker, {
+                    color: colors.filter(function (_, i) { return keep[i]; })
+                });
+            }
+        }
+        return filtered;
+    }
+
+    // Put back the layout template that app.shipped_figures sends once for all figures
+    function shippedFigure(shipped, name) {
+        var figure = shipped && shipped.figures && shipped.figures[name];
+        if (!figure) {
+            return {};
+        }
+        return Object.assign({}, figure, {layout: Object.assign({template: shipped.template}, figure.layout)});
+    }
+
+    // The same as building the figure from the rows whose x is selected
+    function filterByState(figure, selected) {
+        if (!selected) {
+            return figure;
+        }
+        return Object.assign({}, figure, {
+            data: (figure.data || []).map(function (trace) {
+                return filterTrace(trace, (trace.x || []).map(function (state) { return selected.has(state); }));
+            })
+        });
+    }
+
+    function stateSummary(rows, selected) {
+        if (!selected) {
+            return 'Select one or more states to view a summary of their performance.';
+        }
+        var lines = (rows || []).filter(function (row) {
+            return selected.has(row.seller_state);
+        }).map(function (row) {
+            var line = '📍 ' + row.seller_state + ': Total Sellers: ' + row.total_sellers + ', ';
+            line += row.new_sellers === 0 ? 'New Sellers: 0 (No new sellers in this period), ' : 'New Sellers: ' + row.new_sellers + ', ';
+            line += row.old_sellers === 0 ? 'Old Sellers: 0 (No old sellers in this period)' : 'Old Sellers: ' + row.old_sellers;
+            return {namespace: 'dash_html_components', type: 'Li', props: {children: line}};
+        });
+        return {namespace: 'dash_html_components', type: 'Ul', props: {children: lines}};
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        olist: {
+            // Graph 2: the bar chart of the selected month, hidden behind the
+            // segment line chart while a segment is selected
+            showMonthCharts: function (month, segment, figures) {
+                var shown = {display: 'block'};
+                var hidden = {display: 'none'};
+                return [shippedFigure(figures, month || ''), segment ? hidden : shown, segment ? shown : hidden];
+            },
+
+            // Graph 3: both charts and the summary of the selected states (all
+            // states in the charts when none is selected)
+            stateCharts: function (states, figures, rows) {
+                var selected = states && states.length ? new Set(states) : null;
+                return [
+                    filterByState(shippedFigure(figures, 'gradient'), selected),
+                    filterByState(shippedFigure(figures, 'bar'), selected),
+                    stateSummary(rows, selected)
+                ];
+            }
+        }
+    });
+})();
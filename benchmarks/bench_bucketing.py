@@ -0,0 +1,91 @@
+"""Compare the old row-wise ``.apply`` bucketing with ``bucketing``.
+
+    python benchmarks/bench_bucketing.py [rows]
+
+Runs the three Graph 4 bucketings (age_category, trx_happened,
+transaction_age_mark) both ways on synthetic order rows, checks that the
+labels agree and prints the timings and speed-up.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bucketing  # noqa: E402
+
+FILTER_DATE = np.datetime64(pd.to_datetime("2018-06-30"))
+
+
+def apply_age_category(won_date):
+    return (FILTER_DATE - won_date).dt.days.apply(
+        lambda x:
+        "Not joining yet" if x <= 0 else
+        "1 month" if x <= 30 else
+        "2 months" if x <= 60 else
+        "3 months" if x <= 90 else
+        "More than 3 months")
+
+
+def apply_trx_happened(purchase):
+    return purchase.apply(
+        lambda x:
+        "Trx has happened" if x < FILTER_DATE else
+        "Trx hasn't happened")
+
+
+def apply_transaction_age_mark(transaction_age):
+    return transaction_age.apply(
+        lambda x:
+        "Month 1" if x <= 30 else
+        "Month 2" if x <= 60 else
+        "Month 3" if x <= 90 else
+        "Old seller")
+
+
+def vectorized_age_category(won_date):
+    return bucketing.bucketize(FILTER_DATE - won_date, bucketing.AGE_EDGES, bucketing.AGE_CATEGORIES)
+
+
+def vectorized_trx_happened(purchase):
+    return bucketing.trx_happened(purchase, FILTER_DATE)
+
+
+def vectorized_transaction_age_mark(transaction_age):
+    return bucketing.transaction_age_mark(transaction_age)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main(rows=1_000_000, seed=0):
+    rng = np.random.default_rng(seed)
+    won_date = pd.Series(pd.Timestamp('2017-12-01') + pd.to_timedelta(rng.integers(0, 270, rows), unit='D'))
+    purchase = pd.Series(won_date + pd.to_timedelta(rng.integers(-30, 300, rows), unit='D'))
+    transaction_age = (purchase - won_date).dt.days
+
+    cases = [
+        ('age_category', apply_age_category, vectorized_age_category, won_date),
+        ('trx_happened', apply_trx_happened, vectorized_trx_happened, purchase),
+        ('transaction_age_mark', apply_transaction_age_mark, vectorized_transaction_age_mark, transaction_age),
+    ]
+    print(f"{rows:,} rows")
+    total_apply = total_vectorized = 0.0
+    for name, old, new, column in cases:
+        t_apply, expected = timed(old, column)
+        t_vectorized, result = timed(new, column)
+        assert (np.asarray(result, dtype=object) == expected.to_numpy()).all(), name
+        total_apply += t_apply
+        total_vectorized += t_vectorized
+        print(f"{name:<22} apply {t_apply:8.3f}s  vectorized {t_vectorized:8.4f}s  x{t_apply / t_vectorized:,.0f}")
+    print(f"{'total':<22} apply {total_apply:8.3f}s  vectorized {total_vectorized:8.4f}s  x{total_apply / total_vectorized:,.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,215 @@
+"""End-to-end benchmark of the dashboard: startup, memory and callback latency.
+
+    python benchmarks/bench_dashboard.py [--db PATH | --scale N] [--requests N]
+                                         [--save results.json] [--baseline results.json]
+
+Runs the app against ``--db`` (or a database from ``synthetic.py`` at
+``--scale`` times the Olist sample, generated once into ``benchmarks/data/``)
+in fresh processes and reports:
+
+* startup: importing ``app``, ``data.warm()`` and the first page load, with
+  an empty snapshot cache (cold) and again from the cache the first run left
+* the peak RSS of both processes
+* p50/p99 latency and response size of every server-side callback
+  (``update_chart`` through ``update_cohort_heatmap``), posted to
+  ``/_dash-update-component`` through the Flask test client with
+  ``figcache`` cleared first, so each request does the full work
+
+``--save`` writes the results as JSON and ``--baseline`` prints them next to
+earlier saved results. The OLIST_* settings (e.g. ``OLIST_QUERY_ENGINE``)
+are passed through to the app.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, 'benchmarks', 'data')
+
+CALLBACKS = ['update_chart', 'update_segment_line', 'update_chart_4_1', 'update_chart_4_3', 'update_seller_options',
+             'update_cohort_heatmap']
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def scenarios(app, data, graph4):
+    """Input values to cycle through for each callback, as the dropdowns would send them."""
+    graph1_index = data.get('graph1_index')
+    cities = [None] + list(graph1_index.cities[:3])
+    segments = [None] + list(graph1_index.segments[:3])
+    cube = data.get('graph4_cube')
+    graph4_inputs = [(month, age) for month in graph4.CUT_OFF_MONTHS for age in graph4.SELLER_AGES]
+    selections = {(month, age): cube.get(month, age).sellers.search(limit=3) for month, age in graph4_inputs}
+    return {
+        'update_chart': [(city, segment) for city in cities for segment in segments],
+        'update_segment_line': [(segment,) for segment in segments],
+        'update_chart_4_1': graph4_inputs,
+        'update_chart_4_3': [(month, age, selected)
+                             for month, age in graph4_inputs
+                             for selected in (None, selections[month, age])],
+        'update_seller_options': [(month, age, search, selected)
+                                  for month, age in graph4_inputs
+                                  for search, selected in ((None, None), ('a', selections[month, age]))],
+        'update_cohort_heatmap': [(measure, period) for measure in app.COHORT_MEASURES for period in app.cohorts.PRESETS],
+    }
+
+
+def request_body(dash_app, name, values):
+    """The ``/_dash-update-component`` payload of callback ``name`` for its input and state ``values``."""
+    for output, spec in dash_app.callback_map.items():
+        if getattr(spec.get('callback'), '__name__', None) == name:
+            break
+    else:
+        raise KeyError(name)
+    if output.startswith('..'):
+        outputs = [dict(zip(('id', 'property'), item.rsplit('.', 1))) for item in output[2:-2].split('...')]
+    else:
+        outputs = dict(zip(('id', 'property'), output.rsplit('.', 1)))
+    inputs = [{**item, 'value': value} for item, value in zip(spec['inputs'], values)]
+    state = [{**item, 'value': value} for item, value in zip(spec['state'], values[len(inputs):])]
+    return {
+        'output': output,
+        'outputs': outputs,
+        'inputs': inputs,
+        'state': state,
+        'changedPropIds': [f"{item['id']}.{item['property']}" for item in inputs],
+    }
+
+
+def run_worker(requests):
+    """Runs in the child process; prints its results as JSON."""
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    import app
+    import data
+    import figcache
+    import graph4
+    imported = time.perf_counter()
+    data.warm()
+    warmed = time.perf_counter()
+    client = app.server.test_client()
+    page = client.get('/_dash-layout')
+    assert page.status_code == 200, page.status_code
+    loaded = time.perf_counter()
+    result = {
+        'startup': {
+            'import_s': imported - start,
+            'warm_s': warmed - imported,
+            'layout_s': loaded - warmed,
+            'total_s': loaded - start,
+        },
+        'callbacks': {},
+    }
+
+    cases = scenarios(app, data, graph4) if requests else {}
+    for name in CALLBACKS if cases else ():
+        bodies = [request_body(app.app, name, values) for values in cases[name]]
+        seconds, sizes = [], []
+        for i in range(requests):
+            figcache.clear()
+            start = time.perf_counter()
+            response = client.post('/_dash-update-component', json=bodies[i % len(bodies)])
+            seconds.append(time.perf_counter() - start)
+            assert response.status_code in (200, 204), (name, response.status_code)
+            sizes.append(len(response.data))
+        result['callbacks'][name] = {
+            'requests': requests,
+            'p50_ms': float(np.percentile(seconds, 50)) * 1000,
+            'p99_ms': float(np.percentile(seconds, 99)) * 1000,
+            'max_ms': max(seconds) * 1000,
+            'mean_bytes': float(np.mean(sizes)),
+        }
+    result['peak_rss_mib'] = peak_rss_mib()
+    print(json.dumps(result))
+
+
+def spawn(db_path, snapshot_dir, requests):
+    env = dict(os.environ, OLIST_DB_PATH=db_path, OLIST_SNAPSHOT_DIR=snapshot_dir, OLIST_METRICS='0')
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', '--requests', str(requests)],
+        env=env, cwd=ROOT, check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def synthetic_db(scale):
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    import synthetic
+
+    path = os.path.join(DATA_DIR, f'synthetic-{scale:g}x.sqlite')
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Generating {path}", file=sys.stderr)
+        synthetic.generate(path + '.tmp', scale)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def report(results, baseline=None):
+    def line(label, keys, unit, scale=1):
+        value, base = results, baseline
+        for key in keys:
+            value = value[key]
+            base = base.get(key) if isinstance(base, dict) else None
+        text = f"  {label:<26} {value * scale:10.1f} {unit}"
+        if base:
+            text += f"   baseline {base * scale:10.1f} {unit}  x{value / base:.2f}"
+        print(text)
+
+    print(results['db'])
+    for run, label in (('cold', 'empty snapshot cache'), ('cached', 'from the snapshot cache')):
+        print(f"startup ({label})")
+        for key in ('import_s', 'warm_s', 'layout_s', 'total_s'):
+            line(key[:-2], (run, 'startup', key), 'ms', 1000)
+        line('peak RSS', (run, 'peak_rss_mib'), 'MiB')
+    print(f"callbacks ({results['requests']} requests each, figcache cleared)")
+    for name in results['cold']['callbacks']:
+        line(f"{name} p50", ('cold', 'callbacks', name, 'p50_ms'), 'ms')
+        line(f"{name} p99", ('cold', 'callbacks', name, 'p99_ms'), 'ms')
+        line(f"{name} size", ('cold', 'callbacks', name, 'mean_bytes'), 'KiB', 1 / 2**10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--db', help="database to serve (default: olist_PDDS.sqlite)")
+    source.add_argument('--scale', type=float, help="serve a synthetic database this many times the Olist sample")
+    parser.add_argument('--requests', type=int, default=50, help="requests per callback")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare with results saved by --save")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(args.requests)
+        return
+
+    db_path = synthetic_db(args.scale) if args.scale else os.path.abspath(args.db or os.path.join(ROOT, 'olist_PDDS.sqlite'))
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        results = {
+            'db': db_path,
+            'requests': args.requests,
+            'cold': spawn(db_path, snapshot_dir, args.requests),
+            'cached': spawn(db_path, snapshot_dir, 0),
+        }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
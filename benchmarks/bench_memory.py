@@ -0,0 +1,81 @@
+"""Compare the memory of ``order_new_seller`` before and after ``columnar``.
+
+    python benchmarks/bench_memory.py [orders]
+
+Builds synthetic Olist-like orders and closed deals, prepares
+``order_new_seller`` the old way (object strings, datetime64 columns and
+string labels for every intermediate) and with ``data._prepare_order_new_seller``,
+and prints the deep memory usage of both and the time of the Graph 4
+group-by on each.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bucketing  # noqa: E402
+import data  # noqa: E402
+from synthetic import hex_ids  # noqa: E402
+
+
+def synthetic(orders, sellers, seed=0):
+    rng = np.random.default_rng(seed)
+    seller_ids = pd.Series(hex_ids(rng, sellers))
+    won_date = pd.Timestamp('2017-12-01') + pd.to_timedelta(rng.integers(0, 270, sellers), unit='D')
+    closed_deals = pd.DataFrame({
+        'seller_id': seller_ids,
+        'won_date': pd.Series(won_date).dt.strftime('%d/%m/%Y %H:%M'),
+    })
+    purchase = pd.Timestamp('2017-12-01') + pd.to_timedelta(rng.integers(0, 400 * 24 * 60, orders), unit='min')
+    order = pd.DataFrame({
+        'order_id': hex_ids(rng, orders),
+        'seller_id': seller_ids.sample(orders, replace=True, random_state=seed).to_numpy(),
+        'status': np.where(rng.random(orders) < 0.97, 'delivered', 'shipped'),
+        'amount': rng.gamma(2.0, 60.0, orders).round(2),
+        'order_purchase_timestamp': pd.Series(purchase).dt.strftime('%d/%m/%Y %H:%M'),
+        'order_delivered_customer_date': (pd.Series(purchase) + pd.Timedelta(days=9)).dt.strftime('%d/%m/%Y %H:%M'),
+    })
+    return order, closed_deals
+
+
+def old_order_new_seller(order, closed_deals):
+    order_new_seller = order[order['seller_id'].isin(closed_deals['seller_id'])]
+    order_new_seller = order_new_seller[order_new_seller['status'] == 'delivered']
+    order_new_seller = order_new_seller.merge(closed_deals, on='seller_id', how='left')
+    order_new_seller['order_purchase_timestamp'] = pd.to_datetime(order_new_seller['order_purchase_timestamp'], format="%d/%m/%Y %H:%M").dt.normalize()
+    order_new_seller = order_new_seller.drop(order_new_seller[order_new_seller['order_delivered_customer_date'] == "00/01/1900 00:00"].index)
+    order_new_seller['order_delivered_customer_date'] = pd.to_datetime(order_new_seller['order_delivered_customer_date'], format='%d/%m/%Y %H:%M').dt.normalize()
+    order_new_seller['join_month'] = order_new_seller['won_date'] + pd.offsets.MonthEnd(0)
+    order_new_seller['Seller age as of threshold date'] = (data.FILTER_DATE - order_new_seller['won_date']).dt.days
+    order_new_seller['age_category'] = np.asarray(bucketing.bucketize(
+        order_new_seller['Seller age as of threshold date'], bucketing.AGE_EDGES, bucketing.AGE_CATEGORIES), dtype=object)
+    order_new_seller['trx_happened'] = np.asarray(bucketing.trx_happened(order_new_seller['order_purchase_timestamp'], data.FILTER_DATE), dtype=object)
+    order_new_seller['transaction_age'] = (order_new_seller['order_purchase_timestamp'] - order_new_seller['won_date']).dt.days
+    order_new_seller['transaction_age_mark'] = np.asarray(bucketing.transaction_age_mark(order_new_seller['transaction_age']), dtype=object)
+    return order_new_seller
+
+
+def timed_groupby(frame):
+    start = time.perf_counter()
+    frame.groupby(['seller_id', 'won_date'], observed=True).agg(amount=('amount', 'sum'), order_id=('order_id', 'count'))
+    return time.perf_counter() - start
+
+
+def main(orders=1_000_000, sellers=5_000):
+    order, closed_deals = synthetic(orders, sellers)
+    old = old_order_new_seller(order, data._parse_won_date(closed_deals))
+    new = data._prepare_order_new_seller(order, data._parse_won_date(closed_deals))
+    old_bytes = old.memory_usage(deep=True).sum()
+    new_bytes = new.memory_usage(deep=True).sum()
+    print(f"{len(new):,} rows of order_new_seller")
+    print(f"old     {old_bytes / 2**20:8.1f} MiB  group-by {timed_groupby(old):.4f}s")
+    print(f"compact {new_bytes / 2**20:8.1f} MiB  group-by {timed_groupby(new):.4f}s")
+    print(f"x{old_bytes / new_bytes:.1f} smaller")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,213 @@
+"""Synthetic Olist-like databases for the benchmarks.
+
+    python benchmarks/synthetic.py out.sqlite [scale] [seed]
+
+Writes the three tables the dashboard reads (``sellers``, ``closed_deals``
+and ``order_2``) with the columns and text formats of ``olist_PDDS.sqlite``,
+at ``scale`` times the size of the Olist sample (about 3k sellers, 840
+closed deals and 113k order rows at 1x, so 10, 100 and 1000 give the 10x,
+100x and 1000x datasets). The data is skewed the way the sample is:
+
+* a few sellers take most orders (Zipf-like popularity) and most sellers
+  are in SP, a few cities per state
+* orders grow over the two years, with a Black Friday spike, and a new
+  seller's orders only start once the deal is won
+* won dates pile up in the first half of 2018, business segments are uneven
+* about 3% of orders are not delivered (sentinel delivery date), and about
+  half of the closed deals never show up in ``sellers``
+
+The same ``scale`` and ``seed`` always give the same database. Orders are
+written in chunks, so even 1000x (about 110M rows, tens of GB on disk) runs
+in bounded memory, if not quickly.
+"""
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+SELLERS = 3_095
+CLOSED_DEALS = 842
+ORDERS = 112_650
+
+ORDER_CHUNK = 1_000_000
+
+DATE_FORMAT = '%d/%m/%Y %H:%M'
+MISSING_DATE = '00/01/1900 00:00'
+
+# Every timestamp written falls in [FIRST_DAY, LAST_DAY)
+FIRST_DAY = pd.Timestamp('2016-09-01')
+LAST_DAY = pd.Timestamp('2019-06-01')
+FIRST_ORDER = pd.Timestamp('2016-09-04')
+LAST_ORDER = pd.Timestamp('2018-10-17')
+FIRST_WON = pd.Timestamp('2017-12-01')
+LAST_WON = pd.Timestamp('2018-11-30')
+BLACK_FRIDAY = pd.Timestamp('2017-11-24')
+
+# (state, share of sellers, cities from the most to the least common)
+STATES = [
+    ('SP', 0.597, ['sao paulo', 'ibitinga', 'campinas', 'guarulhos', 'ribeirao preto', 'santo andre']),
+    ('PR', 0.113, ['curitiba', 'londrina', 'maringa']),
+    ('MG', 0.079, ['belo horizonte', 'uberlandia', 'juiz de fora']),
+    ('SC', 0.061, ['joinville', 'blumenau', 'florianopolis']),
+    ('RJ', 0.055, ['rio de janeiro', 'niteroi', 'petropolis']),
+    ('RS', 0.042, ['porto alegre', 'caxias do sul', 'novo hamburgo']),
+    ('GO', 0.013, ['goiania', 'anapolis']),
+    ('DF', 0.010, ['brasilia']),
+    ('ES', 0.007, ['vitoria', 'vila velha']),
+    ('BA', 0.006, ['salvador', 'feira de santana']),
+    ('CE', 0.004, ['fortaleza']),
+    ('PE', 0.004, ['recife']),
+    ('PB', 0.002, ['joao pessoa']),
+    ('MS', 0.002, ['campo grande']),
+    ('RN', 0.002, ['natal']),
+    ('MT', 0.002, ['cuiaba']),
+]
+
+# (segment, share of closed deals)
+SEGMENTS = [
+    ('home_decor', 0.125), ('health_beauty', 0.110), ('car_accessories', 0.092),
+    ('household_utilities', 0.084), ('construction_tools_house_garden', 0.083),
+    ('audio_video_electronics', 0.077), ('computers', 0.040), ('pet', 0.036),
+    ('food_supplement', 0.033), ('food_drink', 0.029), ('sports_leisure', 0.029),
+    ('bags_backpacks', 0.026), ('toys', 0.026), ('phone_mobile', 0.025),
+    ('stationery', 0.024), ('jewerly', 0.022), ('books', 0.020),
+    ('fashion_accessories', 0.019), ('music_instruments', 0.018), ('baby', 0.016),
+    ('handcrafted', 0.015), ('gifts', 0.014), ('air_conditioning', 0.012),
+    ('small_appliances', 0.012), ('watches', 0.012),
+]
+
+# (status, share of orders); everything but 'delivered' gets MISSING_DATE
+STATUSES = [
+    ('delivered', 0.970), ('shipped', 0.011), ('canceled', 0.006), ('unavailable', 0.006),
+    ('invoiced', 0.003), ('processing', 0.003), ('created', 0.001),
+]
+
+# Share of closed deals whose seller is in ``sellers`` (and so has orders)
+LISTED_DEALS = 0.45
+
+_HEX = np.frombuffer(b'0123456789abcdef', dtype='uint8')
+
+
+def _shares(pairs):
+    names = [pair[0] for pair in pairs]
+    weights = np.array([pair[1] for pair in pairs])
+    return names, weights / weights.sum()
+
+
+def hex_ids(rng, n):
+    """``n`` random 32-character hex IDs like Olist's."""
+    raw = rng.integers(0, 256, (n, 16), dtype='uint8')
+    digits = np.empty((n, 32), dtype='uint8')
+    digits[:, 0::2] = _HEX[raw >> 4]
+    digits[:, 1::2] = _HEX[raw & 15]
+    return digits.view('S32').ravel().astype(str)
+
+
+def _minute_labels():
+    """``DATE_FORMAT`` text of every minute in [FIRST_DAY, LAST_DAY), formatted once."""
+    minutes = pd.date_range(FIRST_DAY, LAST_DAY, freq='min', inclusive='left')
+    return np.asarray(minutes.strftime(DATE_FORMAT), dtype=object)
+
+
+def _random_minutes(rng, days):
+    """Minute offsets of ``days`` (day offsets) at a plausible time of day."""
+    time_of_day = np.clip(rng.normal(14 * 60, 4 * 60, len(days)), 0, 24 * 60 - 1)
+    return days * 1440 + time_of_day.astype('int64')
+
+
+def generate_sellers(rng, n):
+    state_names, state_shares = _shares(STATES)
+    state_index = rng.choice(len(STATES), n, p=state_shares)
+    cities = np.empty(n, dtype=object)
+    for i, (_, _, state_cities) in enumerate(STATES):
+        in_state = state_index == i
+        weights = 1 / np.arange(1, len(state_cities) + 1) ** 1.5
+        cities[in_state] = rng.choice(state_cities, in_state.sum(), p=weights / weights.sum())
+    return pd.DataFrame({
+        'seller_id': hex_ids(rng, n),
+        'seller_zip_code_prefix': rng.integers(1_000, 99_999, n),
+        'seller_city': cities,
+        'seller_state': np.asarray(state_names, dtype=object)[state_index],
+    })
+
+
+def generate_closed_deals(rng, n, seller_ids, labels):
+    listed = rng.random(n) < LISTED_DEALS
+    ids = hex_ids(rng, n).astype(object)
+    ids[listed] = rng.choice(seller_ids, listed.sum(), replace=False)
+    # Deals ramp up towards mid-2018
+    won_days = (FIRST_WON - FIRST_DAY).days + rng.triangular(0, 160, (LAST_WON - FIRST_WON).days, n).astype('int64')
+    segment_names, segment_shares = _shares(SEGMENTS)
+    return pd.DataFrame({
+        'mql_id': hex_ids(rng, n),
+        'seller_id': ids,
+        'won_date': labels[_random_minutes(rng, won_days)],
+        'business_segment': np.asarray(segment_names, dtype=object)[rng.choice(len(SEGMENTS), n, p=segment_shares)],
+    })
+
+
+def generate_orders(rng, n, seller_ids, popularity, won_day, labels):
+    """One chunk of ``order_2``; ``won_day`` is the day offset of each seller's deal (-1 if none)."""
+    first, last = (FIRST_ORDER - FIRST_DAY).days, (LAST_ORDER - FIRST_DAY).days
+    seller = rng.choice(len(seller_ids), n, p=popularity)
+    # Orders grow steadily, plus a Black Friday spike
+    days = first + rng.triangular(0, last - first, last - first, n).astype('int64')
+    black_friday = rng.random(n) < 0.01
+    days[black_friday] = (BLACK_FRIDAY - FIRST_DAY).days + rng.integers(0, 3, black_friday.sum())
+    # New sellers only sell once they joined
+    joined = won_day[seller]
+    late = (joined >= 0) & (days < joined)
+    days[late] = joined[late] + rng.integers(0, np.maximum(last - joined[late], 1))
+    purchase = _random_minutes(rng, days)
+
+    status_names, status_shares = _shares(STATUSES)
+    status = np.asarray(status_names, dtype=object)[rng.choice(len(STATUSES), n, p=status_shares)]
+    delivered = purchase + (rng.gamma(3.0, 4.0, n) * 1440).astype('int64') + 1440
+    delivered_labels = labels[np.minimum(delivered, len(labels) - 1)]
+    delivered_labels[(status != 'delivered') | (rng.random(n) < 0.003)] = MISSING_DATE
+    return pd.DataFrame({
+        'order_id': hex_ids(rng, n),
+        'seller_id': seller_ids[seller],
+        'status': status,
+        'amount': np.round(rng.lognormal(4.6, 0.9, n), 2),
+        'order_purchase_timestamp': labels[purchase],
+        'order_delivered_customer_date': delivered_labels,
+    })
+
+
+def generate(path, scale=1, seed=0):
+    """Write a synthetic database ``scale`` times the Olist sample to ``path`` (replacing it)."""
+    rng = np.random.default_rng(seed)
+    labels = _minute_labels()
+    sellers = generate_sellers(rng, int(SELLERS * scale))
+    seller_ids = sellers['seller_id'].to_numpy()
+    closed_deals = generate_closed_deals(rng, int(CLOSED_DEALS * scale), seller_ids, labels)
+
+    popularity = 1 / rng.permutation(np.arange(1, len(seller_ids) + 1)) ** 1.1
+    popularity /= popularity.sum()
+    won_day = np.full(len(seller_ids), -1, dtype='int64')
+    position = pd.Index(seller_ids).get_indexer(closed_deals['seller_id'])
+    won = pd.to_datetime(closed_deals['won_date'], format=DATE_FORMAT)
+    won_day[position[position >= 0]] = (won - FIRST_DAY).dt.days.to_numpy()[position >= 0]
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        sellers.to_sql('sellers', conn, index=False)
+        closed_deals.to_sql('closed_deals', conn, index=False)
+        remaining = int(ORDERS * scale)
+        while remaining:
+            chunk = min(remaining, ORDER_CHUNK)
+            orders = generate_orders(rng, chunk, seller_ids, popularity, won_day, labels)
+            orders.to_sql('order_2', conn, index=False, if_exists='append')
+            remaining -= chunk
+        conn.commit()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    generate(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1, int(sys.argv[3]) if len(sys.argv) > 3 else 0)
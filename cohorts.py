@@ -0,0 +1,144 @@
+"""Seller cohorts: what new sellers sell by join month and time since joining.
+
+Graph 4 puts each order in one of the fixed ``transaction_age_mark`` buckets
+(Month 1/2/3, Old seller). Here the orders are reduced once to per-seller
+totals per day of seller age (``seller_activity``), and a ``CohortMatrix``
+for any period width and horizon is computed from that in one vectorised
+pass: integer-day arithmetic gives every row its cohort (the month of
+``won_date``) and period, and ``np.bincount`` sums the cells. Matrices are
+cached per (width, horizon) on the ``CohortEngine``, so serving one is a
+dictionary lookup.
+
+Periods are right-inclusive like the marks: with the default width of 30
+days, period 0 is seller ages up to 30 days ("Month 1"), period 1 ages 31 to
+60, and so on. Orders placed before the seller joined count in period 0, the
+way Graph 4 counts them in "Month 1"; orders past the horizon are left out.
+"""
+import threading
+
+import numpy as np
+
+import columnar
+
+# Days per period; the width of the transaction_age_mark buckets
+DEFAULT_WIDTH = 30
+
+# Number of periods in a matrix
+DEFAULT_HORIZON = 12
+
+# Bucketings offered by the cohort heatmap: label -> (width, horizon)
+PRESETS = {
+    '30-day periods': (DEFAULT_WIDTH, DEFAULT_HORIZON),
+    'Weeks': (7, 26),
+}
+
+
+def seller_activity(order_new_seller):
+    """Summed ``amount`` and ``order_id`` count per seller, join date and seller age in days."""
+    order_new_seller = order_new_seller[order_new_seller['won_date'].to_numpy() != columnar.NAT_DAY]
+    transaction_age = order_new_seller['order_purchase_timestamp'].to_numpy() - order_new_seller['won_date'].to_numpy()
+    return (
+        order_new_seller.assign(transaction_age=transaction_age.astype('int32'))
+        .groupby(['seller_id', 'won_date', 'transaction_age'], observed=True)
+        .agg(amount=('amount', 'sum'), order_id=('order_id', 'count'))
+        .reset_index()
+    )
+
+
+def _month_numbers(days):
+    #Months since 1970-01 of int32 day numbers
+    return np.asarray(days, dtype='int64').astype('datetime64[D]').astype('datetime64[M]').astype('int64')
+
+
+class CohortMatrix:
+    """Cohorts (join months, oldest first) by periods since joining.
+
+    ``amount``, ``orders`` and ``active_sellers`` (sellers with at least one
+    order in the period) are ``(len(join_months), horizon)`` arrays;
+    ``sellers`` is the size of each cohort, counting the sellers with any
+    order at all.
+    """
+
+    def __init__(self, join_months, width, amount, orders, active_sellers, sellers):
+        self.join_months = join_months
+        self.width = width
+        self.horizon = amount.shape[1]
+        self.amount = amount
+        self.orders = orders
+        self.active_sellers = active_sellers
+        self.sellers = sellers
+        self._rows = {month: row for row, month in enumerate(join_months)}
+
+    def period_labels(self):
+        """'Month n' for 30-day periods (as in transaction_age_mark), 'Week n' for 7-day ones, else day ranges."""
+        names = {DEFAULT_WIDTH: 'Month', 7: 'Week'}
+        if self.width in names:
+            return [f'{names[self.width]} {period + 1}' for period in range(self.horizon)]
+        return [f'Days {period * self.width + 1}-{(period + 1) * self.width}' for period in range(self.horizon)]
+
+    def retention(self):
+        """Share of each cohort's sellers active in each period."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.sellers[:, None] > 0, self.active_sellers / self.sellers[:, None], np.nan)
+
+    def cohort(self, join_month):
+        """``{'amount', 'orders', 'active_sellers', 'sellers'}`` of one cohort ('YYYY-MM'), or None."""
+        row = self._rows.get(join_month)
+        if row is None:
+            return None
+        return {
+            'amount': self.amount[row],
+            'orders': self.orders[row],
+            'active_sellers': self.active_sellers[row],
+            'sellers': int(self.sellers[row]),
+        }
+
+
+class CohortEngine:
+    """``CohortMatrix`` for any bucketing of a ``seller_activity`` table, computed once each."""
+
+    def __init__(self, activity, presets=PRESETS):
+        self._sellers = activity['seller_id'].cat.codes.to_numpy().astype('int64')
+        months = _month_numbers(activity['won_date'].to_numpy())
+        first, last = (int(months.min()), int(months.max())) if len(months) else (0, -1)
+        #Every month from the first to the last join, empty cohorts included
+        self._cohorts = months - first
+        self._join_months = [str(np.datetime64(month, 'M')) for month in range(first, last + 1)]
+        self._age = activity['transaction_age'].to_numpy().astype('int64')
+        self._amount = activity['amount'].to_numpy()
+        self._orders = activity['order_id'].to_numpy()
+        self._matrices = {}
+        self._lock = threading.Lock()
+        for width, horizon in presets.values():
+            self.matrix(width, horizon)
+
+    def matrix(self, width=DEFAULT_WIDTH, horizon=DEFAULT_HORIZON):
+        found = self._matrices.get((width, horizon))
+        if found is None:
+            with self._lock:
+                found = self._matrices.get((width, horizon))
+                if found is None:
+                    found = self._matrices[width, horizon] = self._build(width, horizon)
+        return found
+
+    def _build(self, width, horizon):
+        cohorts = len(self._join_months)
+        cells = cohorts * horizon
+        #Right-inclusive periods of `width` days, ages up to 0 in the first one
+        period = np.maximum(-(-self._age // width) - 1, 0)
+        kept = period < horizon
+        cell = (self._cohorts * horizon + period)[kept]
+        amount = np.bincount(cell, weights=self._amount[kept], minlength=cells)
+        orders = np.bincount(cell, weights=self._orders[kept], minlength=cells).astype('int64')
+        #A seller counts once per cell and once per cohort however many rows it has there
+        active_cells = np.unique(self._sellers[kept] * cells + cell) % cells
+        active_sellers = np.bincount(active_cells, minlength=cells)
+        members = np.unique(self._sellers * cohorts + self._cohorts) % cohorts if cohorts else np.zeros(0, dtype='int64')
+        return CohortMatrix(
+            self._join_months,
+            width,
+            amount.reshape(cohorts, horizon),
+            orders.reshape(cohorts, horizon),
+            active_sellers.reshape(cohorts, horizon),
+            np.bincount(members, minlength=cohorts),
+        )
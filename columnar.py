@@ -0,0 +1,156 @@
+"""Compact column encodings for the large in-memory frames.
+
+IDs and labels are dictionary-encoded as categoricals: small integer codes
+per row plus one copy of every distinct value, with the categories sorted so
+grouping by the codes orders rows the same way grouping by the strings did.
+Dates are stored as int32 day numbers since 1970-01-01, ``NAT_DAY`` marking
+missing ones.
+
+The database keeps every timestamp as ``DATE_FORMAT`` text, with
+``MISSING_DATE`` for a date that is not known. ``parse_dates`` decodes such
+a column without going through ``strptime``: the strings are viewed as a
+fixed-width byte matrix and the day, month, year, hour and minute are read
+off their columns with integer arithmetic. ``MISSING_DATE`` and nulls become
+NaT. A value that does not fit the layout is left to ``pd.to_datetime``, with
+a format picked by its shape: ISO 8601 for 'YYYY-MM-DD...', day first for
+'d/m/YYYY...'; anything else is an error rather than a guess.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Day number of a missing date
+NAT_DAY = np.iinfo(np.int32).min
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+# Layout of the timestamps in the database, e.g. '24/11/2017 13:05'
+DATE_FORMAT = '%d/%m/%Y %H:%M'
+MISSING_DATE = '00/01/1900 00:00'
+
+_DATE_WIDTH = len(MISSING_DATE)
+_SEPARATORS = {2: '/', 5: '/', 10: ' ', 13: ':'}
+_DIGITS = [i for i in range(_DATE_WIDTH) if i not in _SEPARATORS]
+# Years datetime64[ns] can hold
+_YEARS = (1678, 2261)
+
+# Shapes parse_dates takes outside of DATE_FORMAT
+_ISO_DATE = r'\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?'
+_DAY_FIRST_DATE = r'\d{1,2}/\d{1,2}/\d{4}( \d{1,2}:\d{2}(:\d{2})?)?'
+
+
+def encode(values):
+    """Dictionary-encode ``values`` as a categorical with sorted categories."""
+    return pd.Categorical(values)
+
+
+def decode(values):
+    """Turn a dictionary-encoded Series back into its values."""
+    return values.astype(values.cat.categories.dtype)
+
+
+def day_number(date):
+    """Day number of a single date."""
+    return int((np.datetime64(pd.Timestamp(date), 'D') - _EPOCH).astype('int64'))
+
+
+def day_numbers(dates):
+    """int32 day numbers of datetime values (time of day dropped, NaT -> ``NAT_DAY``)."""
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    days = dates.astype('int64')
+    days[np.isnat(dates)] = NAT_DAY
+    return days.astype('int32')
+
+
+def _decode_dates(values):
+    """datetime64[m] of ``DATE_FORMAT`` text and the mask of the values that do not fit it."""
+    values = np.asarray(values, dtype=object)
+    missing = pd.isna(values)
+    text = np.where(missing, MISSING_DATE, values)
+    try:
+        #One byte wider, so a longer value can't be silently cut to fit
+        raw = text.astype(f'S{_DATE_WIDTH + 1}').view('uint8').reshape(len(text), _DATE_WIDTH + 1)
+    except UnicodeEncodeError:
+        return np.full(len(values), np.datetime64('NaT', 'm')), ~missing
+    missing |= (raw[:, :_DATE_WIDTH] == np.frombuffer(MISSING_DATE.encode(), dtype='uint8')).all(axis=1)
+
+    digits = raw[:, _DIGITS].astype('int64') - ord('0')
+    fits = (raw[:, _DATE_WIDTH] == 0) & ((digits >= 0) & (digits <= 9)).all(axis=1)
+    for position, separator in _SEPARATORS.items():
+        fits &= raw[:, position] == ord(separator)
+    digits = np.where(fits[:, None], digits, 0)
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+    fits &= (month >= 1) & (month <= 12) & (day >= 1) & (hour < 24) & (minute < 60)
+    fits &= (year >= _YEARS[0]) & (year <= _YEARS[1])
+
+    months = np.where(fits, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + np.where(fits, day - 1, 0)
+    #Day 31 of a 30-day month rolls over into the next one
+    fits &= days.astype('datetime64[M]') == months
+    dates = days.astype('datetime64[m]') + (hour * 60 + minute)
+    dates[~fits | missing] = np.datetime64('NaT')
+    return dates, ~fits & ~missing
+
+
+def parse_dates(values):
+    """datetime64[ns] of ``DATE_FORMAT`` text (a Series comes back as a Series with its index).
+
+    ``MISSING_DATE`` and nulls are NaT. ISO 8601 and other day-first values
+    are parsed by ``pd.to_datetime``; any other text raises ``ValueError``.
+    """
+    dates, other = _decode_dates(values)
+    dates = dates.astype('datetime64[ns]')
+    if other.any():
+        dates[other] = _parse_other_dates(np.asarray(values, dtype=object)[other])
+    if isinstance(values, pd.Series):
+        return pd.Series(dates, index=values.index, name=values.name)
+    return dates
+
+
+def _parse_other_dates(values):
+    #Values outside of DATE_FORMAT, each parsed by the format its shape says
+    values = pd.Series(values, dtype=object).str.strip()
+    iso = values.str.fullmatch(_ISO_DATE).fillna(False).to_numpy(dtype=bool)
+    day_first = values.str.fullmatch(_DAY_FIRST_DATE).fillna(False).to_numpy(dtype=bool)
+    unknown = ~(iso | day_first)
+    if unknown.any():
+        raise ValueError(f"Unrecognised date {values[unknown].iloc[0]!r}; expected {DATE_FORMAT!r}")
+    dates = np.empty(len(values), dtype='datetime64[ns]')
+    dates[iso] = pd.to_datetime(values[iso], format='ISO8601').to_numpy()
+    dates[day_first] = pd.to_datetime(values[day_first], format='mixed', dayfirst=True).to_numpy()
+    return dates
+
+
+def parse_days(values):
+    """int32 day numbers of ``DATE_FORMAT`` text (time of day dropped, missing -> ``NAT_DAY``)."""
+    return day_numbers(parse_dates(values))
+
+
+def to_datetime(days):
+    """datetime64 values of int32 day numbers."""
+    days = np.asarray(days)
+    dates = days.astype('int64').astype('datetime64[D]').astype('datetime64[ns]')
+    dates[days == NAT_DAY] = np.datetime64('NaT')
+    return dates
+
+
+def concat(frames):
+    """``pd.concat`` that keeps dictionary-encoded columns encoded.
+
+    Plain ``pd.concat`` falls back to object columns when the categoricals
+    have different categories, so those are unioned (and re-sorted) first.
+    """
+    frames = list(frames)
+    #An empty frame adds no values, and its categories may not even have the same dtype
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    for column in frames[0].columns:
+        dtypes = [frame[column].dtype for frame in frames]
+        if not isinstance(dtypes[0], pd.CategoricalDtype) or all(dtype == dtypes[0] for dtype in dtypes):
+            continue
+        categories = union_categoricals([frame[column] for frame in frames], sort_categories=True).categories
+        frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,811 @@
+"""Data layer for the Olist dashboard.
+
+Nothing is read from ``olist_PDDS.sqlite`` at import time. Each dataset the
+callbacks need is built the first time it is asked for and then kept on the
+current ``Snapshot``, so a worker can start serving immediately and only pays
+for the graphs that are actually viewed. ``warm()`` builds everything up
+front; ``gunicorn.conf.py`` calls it in the master so forked workers share
+one warm copy.
+
+A snapshot only sees the rows up to the ``rowid`` watermark of each table it
+was created with. ``refresh()`` reads the new watermarks and, when rows were
+appended, builds the next snapshot from the previous one plus the new rows
+only: datasets with a registered updater fold the delta into their previous
+value, the rest are rebuilt from in-memory inputs. The new snapshot is then
+swapped in atomically. Rows that were updated or deleted in place cannot be
+seen through watermarks; ``refresh(full=True)`` rebuilds everything.
+
+The frames of a warm snapshot are also written to ``SNAPSHOT_DIR`` (see
+``framestore``), keyed on the identity, size and mtime of the database file
+(taken before its watermarks are read) and the snapshot's watermarks. The
+next process whose database matches loads them instead of querying and
+parsing again; any change to the file means a fresh build. ``python data.py`` fills the cache
+as a build step. Snapshots are served from memory-mapped views of those
+files, so the gunicorn workers share one copy of the aggregates' inputs,
+including after each of them refreshes to the same database state.
+
+``warm()`` builds the served datasets concurrently, one thread per graph
+pipeline; ``Snapshot.get`` resolves the dependencies between them and each
+dataset is built once however many pipelines need it. The order table, which
+is most of a full build, is read and prepared in ``BUILD_PROCESSES`` worker
+processes, each taking one range of seller IDs.
+
+``order_2`` is streamed rather than loaded whole: only delivered orders are
+read, ``ORDER_CHUNK_ROWS`` at a time, and each chunk is cut down to the new
+sellers' orders and folded into the per-seller Graph 4 and cohort aggregates
+(``ORDER_AGGREGATES``) before the next is fetched, so neither the raw table
+nor ``order_new_seller`` is ever held in full.
+"""
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import bucketing
+import cohorts
+import columnar
+import db
+import framestore
+import graph1
+import graph4
+import sqlengine
+
+DB_PATH = os.environ.get('OLIST_DB_PATH', 'olist_PDDS.sqlite')
+
+# Where built frames are kept between runs, see framestore (empty turns it off)
+SNAPSHOT_DIR = os.environ.get('OLIST_SNAPSHOT_DIR', 'snapshot_cache')
+
+# Worker processes preparing the order table in a full build (1 turns them off)
+BUILD_PROCESSES = int(os.environ.get('OLIST_BUILD_PROCESSES', str(os.cpu_count() or 1)))
+
+# Smaller order tables are prepared in-process: starting the workers would cost more
+PARALLEL_MIN_ORDERS = 500_000
+
+# Orders read from order_2 at a time in a full build; peak memory grows with
+# this rather than with the size of the table
+ORDER_CHUNK_ROWS = int(os.environ.get('OLIST_ORDER_CHUNK_ROWS', '100000'))
+
+# Rows of per-chunk aggregates kept before they are added up
+FOLD_ROWS = 2_000_000
+
+logger = logging.getLogger(__name__)
+
+# Cut-off date used for the `trx_happened` flag in Graph 4
+FILTER_DATE = np.datetime64(pd.to_datetime("2018-06-30"))
+
+# Rename states
+STATE_NAME_MAPPING = {
+    'SP': 'São Paulo (SP)', 'RJ': 'Rio de Janeiro (RJ)', 'MG': 'Minas Gerais (MG)', 'RS': 'Rio Grande do Sul (RS)', 'BA': 'Bahia (BA)',
+    'CE': 'Ceará (CE)', 'DF': 'Distrito Federal (DF)', 'ES': 'Espírito Santo (ES)', 'GO': 'Goiás (GO)', 'PB': 'Paraíba (PB)',
+    'PE': 'Pernambuco (PE)', 'PR': 'Paraná (PR)', 'SC': 'Santa Catarina (SC)', 'AC': 'Acre (AC)', 'AM': 'Amazonas (AM)',
+    'MA': 'Maranhão (MA)', 'MS': 'Mato Grosso do Sul (MS)', 'MT': 'Mato Grosso (MT)', 'PA': 'Pará (PA)', 'PI': 'Piauí (PI)', 'RN': 'Rio Grande do Norte (RN)',
+    'RO': 'Rondônia (RO)', 'SE': 'Sergipe (SE)'
+}
+
+TABLES = ['closed_deals', 'sellers', 'order_2']
+
+# Datasets the app reads; everything else is an intermediate built on demand
+SERVED = ['graph1_index', 'month_counts', 'top_10_month_counts', 'state_summary', 'graph4_cube', 'cohorts']
+
+# Frames written to the snapshot cache (and mapped by the workers): the served
+# aggregates' inputs and what the updaters read
+PERSISTED = ['closed_deals', 'sellers', 'gr2_df', 'month_counts', 'state_counts', 'graph4_totals', 'graph4_trend',
+             'cohort_activity']
+
+# Columns of the raw tables the datasets read
+CLOSED_DEAL_COLUMNS = ['seller_id', 'won_date']
+SELLER_COLUMNS = ['seller_id', 'seller_state']
+
+# Smallest SQLite rowid, the lower bound of a full read
+MIN_ROWID = -2 ** 63
+
+# Every query is bounded by the snapshot watermarks: `:<table>_hi` is the
+# last rowid the snapshot sees and `:<table>_lo` the first one to read
+# (MIN_ROWID for a full read, the previous watermark + 1 for new rows only).
+# Graph 1 SQL query
+SQL_GR2 = """
+SELECT seller_id, seller_city, won_date, business_segment
+FROM sellers
+NATURAL JOIN closed_deals
+WHERE (closed_deals.rowid >= :closed_deals_lo OR sellers.rowid >= :sellers_lo)
+  AND closed_deals.rowid <= :closed_deals_hi AND sellers.rowid <= :sellers_hi
+"""
+
+# Graph 2 SQL query
+SQL_GR1 = """
+SELECT business_segment, won_date, seller_ID
+FROM closed_deals
+WHERE rowid BETWEEN :closed_deals_lo AND :closed_deals_hi
+"""
+
+_builders = {}
+_updaters = {}
+_versions = itertools.count(1)
+
+
+def dataset(name):
+    """Register ``func(snapshot)`` as the builder for dataset ``name``."""
+    def register(func):
+        _builders[name] = func
+        return func
+    return register
+
+
+def updater(name):
+    """Register ``func(snapshot, previous_value)`` to bring dataset ``name`` up to date.
+
+    It is used instead of the builder when the snapshot was refreshed from one
+    that already had the dataset; ``snapshot.new_rows()`` and
+    ``snapshot.previous`` give it the delta and the old inputs.
+    """
+    def register(func):
+        _updaters[name] = func
+        return func
+    return register
+
+
+def read_watermarks(db_path):
+    return {
+        table: db.scalar(db_path, f"SELECT coalesce(max(rowid), 0) FROM {table}", label=f"watermark {table}")
+        for table in TABLES
+    }
+
+
+class Snapshot:
+    """One consistent view of the database, with datasets built on demand.
+
+    ``version`` is unique per snapshot, so anything derived from it (such as
+    cached figures) can tell when it has been replaced.
+    """
+
+    def __init__(self, db_path=DB_PATH, watermarks=None, previous=None, frames=None):
+        self.db_path = db_path
+        self.version = next(_versions)
+        self.watermarks = watermarks if watermarks is not None else read_watermarks(db_path)
+        self.previous = previous
+        self._frames = dict(frames or {})
+        # Key of the snapshot cache entry for these frames, and whether it is written
+        self.cache_key = None
+        self.persisted = False
+        # One lock per dataset, so independent ones build concurrently while
+        # a dataset two builders need is still built once
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def get(self, name):
+        previous = self.previous
+        if previous is not None and name in _updaters and name in previous._frames:
+            return self.cached(name, lambda snap: _updaters[name](snap, previous._frames[name]))
+        return self.cached(name, _builders[name])
+
+    def cached(self, name, build):
+        """Return ``name``, computing it once with ``build(snapshot)``."""
+        frame = self._frames.get(name)
+        if frame is not None:
+            return frame
+        with self._locks_lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._frames:
+                self._frames[name] = build(self)
+            return self._frames[name]
+
+    def _params(self, new_rows=False):
+        params = {}
+        for table in TABLES:
+            params[f'{table}_lo'] = self.previous.watermarks[table] + 1 if new_rows else MIN_ROWID
+            params[f'{table}_hi'] = self.watermarks[table]
+        return params
+
+    def query(self, sql, params=None, new_rows=False, label=None):
+        """Run ``sql`` with the watermark parameters (plus ``params``)."""
+        return db.query(self.db_path, sql, params={**self._params(new_rows), **(params or {})}, label=label)
+
+    def query_chunks(self, sql, params=None, new_rows=False, label=None):
+        """``query``, ``ORDER_CHUNK_ROWS`` rows at a time."""
+        return db.query_chunks(self.db_path, sql, params={**self._params(new_rows), **(params or {})},
+                               label=label, chunksize=ORDER_CHUNK_ROWS)
+
+    def table(self, table, columns=None, new_rows=False):
+        """All rows of ``table`` this snapshot sees, or only the rows added since ``previous``."""
+        return self.query(
+            f"SELECT {', '.join(columns) if columns else '*'} FROM {table} WHERE rowid BETWEEN :{table}_lo AND :{table}_hi",
+            new_rows=new_rows,
+            label=f"table {table}" + (" (new rows)" if new_rows else ""),
+        )
+
+    def new_rows(self, table, columns=None):
+        return self.table(table, columns, new_rows=True)
+
+    def warm(self):
+        missing = [name for name in SERVED if name not in self._frames]
+        if len(missing) > 1:
+            with concurrent.futures.ThreadPoolExecutor(len(missing), thread_name_prefix='warm') as pool:
+                # list() re-raises the first build error
+                list(pool.map(self.get, missing))
+        for name in SERVED:
+            self.get(name)
+        return self
+
+    def refresh(self, full=False):
+        """Return a snapshot with the rows appended since this one was taken.
+
+        Returns ``self`` when nothing changed. Datasets already built here are
+        built on the new snapshot too, so it is warm by the time it is used.
+        """
+        watermarks = read_watermarks(self.db_path)
+        if not full and watermarks == self.watermarks:
+            return self
+        # A watermark going down means rows were deleted, which a delta can't express
+        full = full or any(watermarks[table] < self.watermarks[table] for table in TABLES)
+        snap = Snapshot(self.db_path, watermarks, previous=None if full else self)
+        for name in _builders:
+            if name in self._frames:
+                snap.get(name)
+        # Let the old frames go once nothing reads them anymore
+        snap.previous = None
+        return snap
+
+
+_current = None
+_current_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_stop_refresh = threading.Event()
+
+
+def current():
+    """Return the snapshot callbacks should read from, creating it if needed."""
+    global _current
+    if _current is None:
+        with _current_lock:
+            if _current is None:
+                db.enable_wal(DB_PATH)
+                if sqlengine.enabled():
+                    sqlengine.ensure_indexes(DB_PATH)
+                _current = _open_snapshot()
+    return _current
+
+
+def _cache_key(file_state, watermarks):
+    """Snapshot cache key of frames built at ``watermarks``; ``file_state`` is taken before those are read."""
+    return f"v{framestore.FORMAT_VERSION}-{sqlengine.ENGINE}-{framestore.fingerprint(file_state, watermarks)}"
+
+
+def _open_snapshot():
+    """A new snapshot, starting from the snapshot cache when it matches the database."""
+    if not SNAPSHOT_DIR:
+        return Snapshot(DB_PATH)
+    #The file first: a write after it changes the watermarks or the next state
+    file_state = framestore.file_state(DB_PATH)
+    watermarks = read_watermarks(DB_PATH)
+    key = _cache_key(file_state, watermarks)
+    snap = _load_shared(key, watermarks)
+    if snap is None:
+        snap = Snapshot(DB_PATH, watermarks)
+        snap.cache_key = key
+    return snap
+
+
+def _load_shared(key, watermarks=None):
+    """A snapshot over the memory-mapped frames of cache entry ``key``, or None."""
+    try:
+        cached = framestore.load(SNAPSHOT_DIR, key, mmap=True)
+    except Exception:
+        logger.warning("Could not read the snapshot cache in %s", SNAPSHOT_DIR, exc_info=True)
+        return None
+    if cached is None or (watermarks is not None and cached[0] != watermarks):
+        return None
+    snap = Snapshot(DB_PATH, watermarks=cached[0], frames=cached[1])
+    snap.cache_key = key
+    snap.persisted = True
+    logger.info("Loaded %d frames from the snapshot cache", len(cached[1]))
+    return snap
+
+
+def _share(snap):
+    """Write ``snap`` to the snapshot cache and serve it from the mapped files.
+
+    The returned snapshot holds the persisted frames as read-only views of
+    the cache files, which all workers map from the same pages, plus the
+    small served datasets of ``snap``; intermediates such as
+    ``order_aggregates`` are not kept. ``snap`` is returned as it is when the
+    cache is off or can't be written.
+    """
+    if snap.cache_key is None or snap.persisted:
+        return snap
+    shared = _load_shared(snap.cache_key, snap.watermarks)
+    if shared is None:
+        frames = {name: snap._frames[name] for name in PERSISTED if name in snap._frames}
+        try:
+            framestore.save(SNAPSHOT_DIR, snap.cache_key, snap.watermarks, frames)
+        except Exception:
+            # The next start just builds from the database again
+            logger.warning("Could not write the snapshot cache in %s", SNAPSHOT_DIR, exc_info=True)
+            return snap
+        shared = _load_shared(snap.cache_key, snap.watermarks)
+        if shared is None:
+            return snap
+    for name in SERVED:
+        if name in snap._frames and name not in shared._frames:
+            shared._frames[name] = snap._frames[name]
+    if 'graph4_cube' in snap._frames:
+        #Keep its slices, but let it read the mapped tables instead of snap's copies
+        shared._frames['graph4_cube'] = snap._frames['graph4_cube'].rebased(shared.get('graph4_totals'), shared.get('graph4_trend'))
+    return shared.warm()
+
+
+def get(name):
+    return current().get(name)
+
+
+def version():
+    return current().version
+
+
+def warm():
+    global _current
+    snap = current().warm()
+    shared = _share(snap)
+    with _current_lock:
+        if _current is snap:
+            _current = shared
+    return shared
+
+
+def refresh(full=False):
+    """Pick up new rows from the database and swap in the new snapshot."""
+    global _current
+    with _refresh_lock:
+        previous = current()
+        file_state = framestore.file_state(DB_PATH) if SNAPSHOT_DIR else None
+        snap = previous.refresh(full=full)
+        if snap is not previous and SNAPSHOT_DIR:
+            snap.cache_key = _cache_key(file_state, snap.watermarks)
+            snap = _share(snap)
+        with _current_lock:
+            _current = snap
+    return snap
+
+
+def start_auto_refresh(interval):
+    """Call ``refresh()`` every ``interval`` seconds from a daemon thread."""
+    def run():
+        while not _stop_refresh.wait(interval):
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Refreshing the dashboard data failed")
+
+    thread = threading.Thread(target=run, name='data-refresh', daemon=True)
+    thread.start()
+    return thread
+
+
+## Raw tables
+def _encode_closed_deals(closed_deals):
+    """``CLOSED_DEAL_COLUMNS`` with dictionary-encoded IDs and ``columnar`` day numbers."""
+    return pd.DataFrame({
+        'seller_id': columnar.encode(closed_deals['seller_id']),
+        'won_date': columnar.parse_days(closed_deals['won_date']),
+    })
+
+
+def _encode_sellers(sellers):
+    """``SELLER_COLUMNS``, dictionary-encoded."""
+    return pd.DataFrame({
+        'seller_id': columnar.encode(sellers['seller_id']),
+        'seller_state': columnar.encode(sellers['seller_state']),
+    })
+
+
+@dataset('closed_deals')
+def _build_closed_deals(snap):
+    return _encode_closed_deals(snap.table('closed_deals', CLOSED_DEAL_COLUMNS))
+
+
+@dataset('sellers')
+def _build_sellers(snap):
+    return _encode_sellers(snap.table('sellers', SELLER_COLUMNS))
+
+
+@updater('closed_deals')
+def _update_closed_deals(snap, closed_deals):
+    return columnar.concat([closed_deals, _encode_closed_deals(snap.new_rows('closed_deals', CLOSED_DEAL_COLUMNS))])
+
+
+@updater('sellers')
+def _update_sellers(snap, sellers):
+    return columnar.concat([sellers, _encode_sellers(snap.new_rows('sellers', SELLER_COLUMNS))])
+
+
+## Graph 1
+def _prepare_gr2_df(gr2_df):
+    gr2_df['won_date'] = columnar.parse_dates(gr2_df['won_date'])
+    gr2_df['month'] = gr2_df['won_date'].dt.to_period('M').astype(str)
+    return gr2_df
+
+
+@dataset('gr2_df')
+def _build_gr2_df(snap):
+    return _prepare_gr2_df(snap.query(SQL_GR2, label='gr2'))
+
+
+@updater('gr2_df')
+def _update_gr2_df(snap, gr2_df):
+    #Only the joined rows that involve a new seller or a new closed deal
+    return pd.concat([gr2_df, _prepare_gr2_df(snap.query(SQL_GR2, new_rows=True, label='gr2 (new rows)'))], ignore_index=True)
+
+
+@dataset('graph1_index')
+def _build_graph1_index(snap):
+    if sqlengine.enabled():
+        counts = {by: sqlengine.seller_month_counts(snap, by, graph1.MONTHS) for by in graph1.GROUPINGS}
+        cities = snap.query(sqlengine.SQL_CITIES, label='cities')['seller_city']
+        segments = snap.query(sqlengine.SQL_SEGMENTS, label='segments')['business_segment']
+        return graph1.SellerMonthIndex.from_counts(counts, cities, segments)
+    return graph1.SellerMonthIndex(snap.get('gr2_df'))
+
+
+## Graph 2
+def _prepare_gr1_df(gr1_df):
+    # Converting won_date column from text to datetime
+    # (with the fixed format: inferring it from the first value breaks on a
+    # refresh whose first new deal has a day <= 12)
+    gr1_df['won_date'] = columnar.parse_dates(gr1_df['won_date'])
+    # Converting to a datetime object
+    gr1_df['month'] = gr1_df['won_date'].dt.strftime('%Y-%m')
+    # Filter out months before January 2018
+    return gr1_df[gr1_df['month'] >= '2017-12-31']
+
+
+def _rank_month_counts(month_counts):
+    month_counts['rank'] = month_counts.groupby('month')['segment_count'].rank(method='first', ascending=False)
+    return month_counts
+
+
+@dataset('month_counts')
+def _build_month_counts(snap):
+    if sqlengine.enabled():
+        return _rank_month_counts(snap.query(sqlengine.SQL_MONTH_COUNTS, label='month_counts'))
+    #gr1_df is only needed here: month_counts' updater reads the new deals itself
+    gr1_df = _prepare_gr1_df(snap.query(SQL_GR1, label='gr1'))
+    month_counts = gr1_df.groupby(['business_segment', 'month']).size().reset_index(name='segment_count')
+    return _rank_month_counts(month_counts)
+
+
+@updater('month_counts')
+def _update_month_counts(snap, month_counts):
+    #Add the counts of the new deals to the previous ones and rank again
+    new_deals = _prepare_gr1_df(snap.query(SQL_GR1, new_rows=True, label='gr1 (new rows)'))
+    new_counts = new_deals.groupby(['business_segment', 'month']).size().reset_index(name='segment_count')
+    month_counts = (
+        pd.concat([month_counts[['business_segment', 'month', 'segment_count']], new_counts])
+        .groupby(['business_segment', 'month'])['segment_count'].sum()
+        .reset_index()
+    )
+    return _rank_month_counts(month_counts)
+
+
+@dataset('top_10_month_counts')
+def _build_top_10_month_counts(snap):
+    month_counts = snap.get('month_counts')
+    return month_counts[month_counts['rank'] <= 10]
+
+
+## Graph 3
+@dataset('state_counts')
+def _build_state_counts(snap):
+    #Number of new sellers (in closed_deals) and old sellers per state code
+    if sqlengine.enabled():
+        return snap.query(sqlengine.SQL_STATE_COUNTS, label='state_counts').set_index('seller_state')
+    closed_deals = snap.get('closed_deals')
+    sellers = snap.get('sellers')
+    sellers = pd.DataFrame({
+        'seller_state': columnar.decode(sellers['seller_state']),
+        'is_new_seller': sellers['seller_id'].isin(closed_deals['seller_id']),
+    })
+    return (
+        sellers.groupby('seller_state')
+        .agg(
+            new_sellers=('is_new_seller', 'sum'),  # Count of new sellers
+            old_sellers=('is_new_seller', lambda x: (~x.astype(bool)).sum())  # Count of old sellers (not in closed_deals)
+        )
+    )
+
+
+@updater('state_counts')
+def _update_state_counts(snap, state_counts):
+    if sqlengine.enabled():
+        #A single indexed GROUP BY, cheaper than loading the sellers to apply the delta
+        return _build_state_counts(snap)
+    old_closed_deals = snap.previous.get('closed_deals')
+    old_sellers = snap.previous.get('sellers')
+    new_closed_deals = snap.new_rows('closed_deals', CLOSED_DEAL_COLUMNS)
+    new_sellers = snap.new_rows('sellers', SELLER_COLUMNS)
+
+    #Known sellers that just got their first closed deal move from old to new
+    promoted = old_sellers[
+        old_sellers['seller_id'].isin(new_closed_deals['seller_id'])
+        & ~old_sellers['seller_id'].isin(old_closed_deals['seller_id'])
+    ]
+    promoted = promoted.groupby(columnar.decode(promoted['seller_state'])).size()
+
+    #Sellers added since the previous snapshot are counted like in a full build
+    is_new_seller = new_sellers['seller_id'].isin(old_closed_deals['seller_id']) | new_sellers['seller_id'].isin(new_closed_deals['seller_id'])
+    added = pd.DataFrame({
+        'new_sellers': is_new_seller.groupby(new_sellers['seller_state']).sum(),
+        'old_sellers': (~is_new_seller).groupby(new_sellers['seller_state']).sum(),
+    })
+
+    delta = added.add(pd.DataFrame({'new_sellers': promoted, 'old_sellers': -promoted}), fill_value=0)
+    return state_counts.add(delta, fill_value=0).astype('int64').sort_index()
+
+
+@dataset('state_summary')
+def _build_state_summary(snap):
+    state_summary = snap.get('state_counts').reset_index()
+    state_summary['total_sellers'] = state_summary['new_sellers'] + state_summary['old_sellers']
+    state_summary['seller_state'] = state_summary['seller_state'].map(STATE_NAME_MAPPING).fillna('Unknown State')
+    return state_summary
+
+
+## Graph 4
+def _parse_won_date(closed_deals):
+    #Transform the won_date column as datetime and parse it to date only
+    closed_deals = closed_deals[['seller_id', 'won_date']].copy()
+    closed_deals['won_date'] = columnar.parse_dates(closed_deals['won_date']).dt.normalize()
+    return closed_deals
+
+
+def _closed_deal_dates(snap):
+    """Every closed deal as ``_parse_won_date`` gives it, decoded from ``closed_deals`` once per snapshot."""
+    def build(snap):
+        closed_deals = snap.get('closed_deals')
+        return pd.DataFrame({
+            'seller_id': columnar.decode(closed_deals['seller_id']),
+            'won_date': columnar.to_datetime(closed_deals['won_date']),
+        })
+
+    return snap.cached('closed_deal_dates', build)
+
+
+def _prepare_order_new_seller(order, closed_deals):
+    """Delivered orders of the sellers in ``closed_deals``, with the Graph 4 columns added."""
+    #Filter the order table to only contain the new seller's orders data.
+    order_new_seller = order[order['seller_id'].isin(closed_deals['seller_id'])]
+
+    #Filter the order with the status delivered
+    order_new_seller = order_new_seller[order_new_seller['status'] == 'delivered']
+
+    #Copy the won_date in closed_deals to order_new_seller table to mark the date the seller joins
+    #Using left join
+    order_new_seller = order_new_seller.merge(
+        closed_deals,
+        on = 'seller_id',
+        how = 'left'
+    )
+    return _add_graph4_columns(order_new_seller)
+
+
+def _add_graph4_columns(order_new_seller):
+    """Compact ``order_new_seller`` with the columns Graph 4 reads.
+
+    IDs are dictionary-encoded, dates are ``columnar`` day numbers and the
+    labels are categoricals; ``status`` (always "delivered") and the
+    intermediate age columns are not kept.
+    """
+    #Transform the order_purchase_timestamp column into date only format
+    purchase = columnar.parse_dates(order_new_seller['order_purchase_timestamp']).dt.normalize()
+
+    #Transform the order_delivered_customer_date column into day numbers
+    delivered_date = columnar.parse_days(order_new_seller['order_delivered_customer_date'])
+
+    #Drop rows because in order_delivered_customer_date has some missing values (MISSING_DATE)
+    delivered = delivered_date != columnar.NAT_DAY
+    order_new_seller = order_new_seller[delivered]
+    purchase = purchase[delivered]
+    delivered_date = delivered_date[delivered]
+
+    #Seller age when the transaction happened (order_purchase_timestamp - won_date), in days
+    transaction_age = (purchase - order_new_seller['won_date']).dt.days
+
+    return pd.DataFrame({
+        'order_id': columnar.encode(order_new_seller['order_id']),
+        'seller_id': columnar.encode(order_new_seller['seller_id']),
+        'amount': order_new_seller['amount'].to_numpy(),
+        'order_purchase_timestamp': columnar.day_numbers(purchase),
+        'order_delivered_customer_date': delivered_date,
+        'won_date': columnar.day_numbers(order_new_seller['won_date']),
+        #Mark if the transaction has happened or not based on the filter date
+        'trx_happened': bucketing.trx_happened(purchase, FILTER_DATE),
+        #Group how old the seller was when the transaction happened
+        'transaction_age_mark': bucketing.transaction_age_mark(transaction_age),
+    })
+
+
+# Per-seller aggregates of order_new_seller, all built in one pass over order_2
+ORDER_AGGREGATES = {
+    'graph4_totals': graph4.seller_totals,
+    'graph4_trend': graph4.seller_trend,
+    'cohort_activity': cohorts.seller_activity,
+}
+
+
+def _seller_ranges(seller_ids, count):
+    """``count`` ``(low, high)`` ranges of seller IDs, each with about as many of ``seller_ids``.
+
+    ``low <= seller_id < high``, None meaning unbounded; together they cover every ID.
+    """
+    seller_ids = sorted(set(seller_ids))
+    bounds = sorted({seller_ids[len(seller_ids) * i // count] for i in range(1, count)}) if seller_ids else []
+    bounds = [None] + bounds + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _order_chunks(snap, closed_deals, low=None, high=None):
+    """``order_new_seller``, prepared ``ORDER_CHUNK_ROWS`` orders at a time.
+
+    Only delivered orders are read (and, with ``low``/``high``, only those of
+    the sellers in ``[low, high)``), and each chunk is cut down to the new
+    sellers' rows before the next one is fetched.
+    """
+    if sqlengine.enabled():
+        #Delivered orders of the sellers in closed_deals, already joined with their won_date
+        for chunk in snap.query_chunks(sqlengine.SQL_NEW_SELLER_ORDERS, label='order_new_seller'):
+            chunk['won_date'] = columnar.parse_dates(chunk['won_date']).dt.normalize()
+            yield _add_graph4_columns(chunk)
+        return
+    conditions = ["rowid BETWEEN :order_2_lo AND :order_2_hi", "status = 'delivered'"]
+    if low is not None:
+        conditions.append("seller_id >= :low")
+    if high is not None:
+        conditions.append("seller_id < :high")
+    chunks = snap.query_chunks(
+        "SELECT * FROM order_2 WHERE " + " AND ".join(conditions),
+        params={'low': low, 'high': high},
+        label='table order_2 (delivered)' if low is None and high is None else 'table order_2 (delivered, seller range)',
+    )
+    for chunk in chunks:
+        yield _prepare_order_new_seller(chunk, closed_deals)
+
+
+def _fold_order_chunks(chunks):
+    """The per-seller aggregates of ``order_new_seller`` chunks, added up.
+
+    The chunks' tables are combined in one go at the end, or earlier once
+    they hold more than ``FOLD_ROWS`` rows (and more than the running total),
+    so each row is regrouped a bounded number of times however small the
+    chunks are.
+    """
+    parts = {name: [] for name in ORDER_AGGREGATES}
+    pending = dict.fromkeys(ORDER_AGGREGATES, 0)
+    for chunk in chunks:
+        for name, reduce in ORDER_AGGREGATES.items():
+            reduced = reduce(chunk)
+            parts[name].append(reduced)
+            pending[name] += len(reduced)
+            if pending[name] > max(FOLD_ROWS, 2 * len(parts[name][0])):
+                parts[name] = [graph4.combine(*parts[name])]
+                pending[name] = len(parts[name][0])
+    return {name: graph4.combine(*tables) for name, tables in parts.items() if tables}
+
+
+def _aggregate_order_range(db_path, watermarks, low, high, closed_deals):
+    """``_fold_order_chunks`` of the orders of sellers in ``[low, high)``; runs in a build worker."""
+    return _fold_order_chunks(_order_chunks(Snapshot(db_path, watermarks), closed_deals, low, high))
+
+
+def _build_context():
+    #forkserver (where there is one) rather than fork: workers may run threads
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload([__name__])
+    return context
+
+
+def _order_aggregates(snap):
+    """Every ``ORDER_AGGREGATES`` table of a full build, streamed from ``order_2``."""
+    closed_deals = _closed_deal_dates(snap)
+    if BUILD_PROCESSES > 1 and snap.watermarks['order_2'] >= PARALLEL_MIN_ORDERS and not sqlengine.enabled():
+        #Every seller's orders are in exactly one range, so the parts don't overlap
+        ranges = _seller_ranges(closed_deals['seller_id'].dropna(), BUILD_PROCESSES)
+        with concurrent.futures.ProcessPoolExecutor(len(ranges), mp_context=_build_context()) as pool:
+            parts = [pool.submit(_aggregate_order_range, snap.db_path, snap.watermarks, low, high, closed_deals)
+                     for low, high in ranges]
+            parts = [part.result() for part in parts]
+        return {name: graph4.combine(*(part[name] for part in parts)) for name in ORDER_AGGREGATES}
+    return _fold_order_chunks(_order_chunks(snap, closed_deals))
+
+
+def _new_seller_orders_delta(snap):
+    """The ``order_new_seller`` rows a refresh adds to the previous snapshot's."""
+    new_closed_deals = _parse_won_date(snap.new_rows('closed_deals', CLOSED_DEAL_COLUMNS))
+    closed_deals = _closed_deal_dates(snap)
+
+    #New orders, joined with every closed deal
+    parts = [_prepare_order_new_seller(snap.new_rows('order_2'), closed_deals)]
+
+    #Orders already there before, of the sellers that got a new closed deal
+    seller_ids = new_closed_deals['seller_id'].dropna().unique().tolist()
+    for start in range(0, len(seller_ids), 500):
+        chunk = seller_ids[start:start + 500]
+        placeholders = ', '.join(f':seller_{i}' for i in range(len(chunk)))
+        earlier_orders = snap.query(
+            f"SELECT * FROM order_2 WHERE rowid <= :order_2_previous AND seller_id IN ({placeholders})",
+            params={'order_2_previous': snap.previous.watermarks['order_2'], **{f'seller_{i}': seller for i, seller in enumerate(chunk)}},
+            label='order_2 of sellers with new deals',
+        )
+        parts.append(_prepare_order_new_seller(earlier_orders, new_closed_deals))
+    return columnar.concat(parts)
+
+
+@dataset('graph4_totals')
+def _build_graph4_totals(snap):
+    return snap.cached('order_aggregates', _order_aggregates)['graph4_totals']
+
+
+def _graph4_totals_delta(snap):
+    return graph4.seller_totals(snap.cached('order_new_seller_delta', _new_seller_orders_delta))
+
+
+def _graph4_trend_delta(snap):
+    return graph4.seller_trend(snap.cached('order_new_seller_delta', _new_seller_orders_delta))
+
+
+@updater('graph4_totals')
+def _update_graph4_totals(snap, totals):
+    return graph4.combine(totals, snap.cached('graph4_totals_delta', _graph4_totals_delta))
+
+
+@dataset('graph4_trend')
+def _build_graph4_trend(snap):
+    return snap.cached('order_aggregates', _order_aggregates)['graph4_trend']
+
+
+@updater('graph4_trend')
+def _update_graph4_trend(snap, trend):
+    return graph4.combine(trend, snap.cached('graph4_trend_delta', _graph4_trend_delta))
+
+
+@dataset('graph4_cube')
+def _build_graph4_cube(snap):
+    return graph4.Graph4Cube(snap.get('graph4_totals'), snap.get('graph4_trend'))
+
+
+@updater('graph4_cube')
+def _update_graph4_cube(snap, cube):
+    return cube.updated(
+        snap.get('graph4_totals'),
+        snap.get('graph4_trend'),
+        snap.cached('graph4_totals_delta', _graph4_totals_delta),
+        snap.cached('graph4_trend_delta', _graph4_trend_delta),
+    )
+
+
+## Cohorts
+@dataset('cohort_activity')
+def _build_cohort_activity(snap):
+    return snap.cached('order_aggregates', _order_aggregates)['cohort_activity']
+
+
+@updater('cohort_activity')
+def _update_cohort_activity(snap, activity):
+    delta = cohorts.seller_activity(snap.cached('order_new_seller_delta', _new_seller_orders_delta))
+    return graph4.combine(activity, delta)
+
+
+@dataset('cohorts')
+def _build_cohorts(snap):
+    return cohorts.CohortEngine(snap.get('cohort_activity'))
+
+
+if __name__ == "__main__":
+    # Build step: `python data.py` fills the snapshot cache ahead of starting the app
+    logging.basicConfig(level=logging.INFO)
+    warm()
@@ -0,0 +1,142 @@
+"""Read-only access to ``olist_PDDS.sqlite`` shared by the data layer and the callbacks.
+
+Every thread keeps one read-only connection per database file (opened with
+``mode=ro``), so concurrent callbacks never share, or queue on, a single
+connection and no request reopens the file. The connections are tuned with
+``mmap_size`` and ``cache_size`` and keep their compiled statements between
+queries. They are dropped after a fork so a gunicorn worker never reuses one
+opened in the master.
+
+``enable_wal()`` switches the file to WAL journaling, under which readers
+keep going while rows are appended. Each query is timed per label;
+``stats()`` returns the totals.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Bytes of the database file memory-mapped by each connection
+MMAP_SIZE = int(os.environ.get('OLIST_DB_MMAP_SIZE', str(256 * 2**20)))
+
+# Page cache of each connection, in KiB
+CACHE_SIZE_KB = int(os.environ.get('OLIST_DB_CACHE_KB', str(64 * 2**10)))
+
+# Queries slower than this (in seconds) are logged at INFO
+SLOW_QUERY = float(os.environ.get('OLIST_DB_SLOW_QUERY', '1.0'))
+
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _open(db_path):
+    conn = sqlite3.connect(
+        f"file:{quote(os.path.abspath(db_path))}?mode=ro",
+        uri=True,
+        cached_statements=256,
+    )
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def connection(db_path):
+    """This thread's read-only connection to ``db_path``."""
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+    conn = _local.connections.get(db_path)
+    if conn is None:
+        conn = _local.connections[db_path] = _open(db_path)
+    return conn
+
+
+def enable_wal(db_path):
+    """Switch ``db_path`` to WAL journaling; returns False if the file cannot be written."""
+    conn = sqlite3.connect(db_path)
+    try:
+        mode, = conn.execute("PRAGMA journal_mode = WAL").fetchone()
+        return mode.lower() == 'wal'
+    except sqlite3.OperationalError:
+        logger.warning("Could not switch %s to WAL journaling", db_path, exc_info=True)
+        return False
+    finally:
+        conn.close()
+
+
+def _record(label, seconds, rows):
+    with _stats_lock:
+        entry = _stats.setdefault(label, {'count': 0, 'rows': 0, 'total': 0.0, 'max': 0.0})
+        entry['count'] += 1
+        entry['rows'] += rows
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+    if seconds >= SLOW_QUERY:
+        logger.info("Slow query %s: %.3fs, %d rows", label, seconds, rows)
+    else:
+        logger.debug("Query %s: %.3fs, %d rows", label, seconds, rows)
+
+
+def query(db_path, sql, params=None, label=None):
+    """Run ``sql`` on this thread's connection and return the result as a DataFrame."""
+    if label is None:
+        label = ' '.join(sql.split())[:60]
+    start = time.perf_counter()
+    frame = pd.read_sql_query(sql, connection(db_path), params=params)
+    _record(label, time.perf_counter() - start, len(frame))
+    return frame
+
+
+def query_chunks(db_path, sql, params=None, label=None, chunksize=100_000):
+    """Like ``query``, but yield the result ``chunksize`` rows at a time.
+
+    An empty result still yields one (empty) frame with the columns. The time
+    recorded is the time spent fetching, not the time the caller spends on
+    each chunk.
+    """
+    if label is None:
+        label = ' '.join(sql.split())[:60]
+    chunks = iter(pd.read_sql_query(sql, connection(db_path), params=params, chunksize=chunksize))
+    seconds, rows = 0.0, 0
+    try:
+        while True:
+            start = time.perf_counter()
+            frame = next(chunks, None)
+            seconds += time.perf_counter() - start
+            if frame is None:
+                break
+            rows += len(frame)
+            yield frame
+    finally:
+        _record(label, seconds, rows)
+
+
+def scalar(db_path, sql, params=None, label=None):
+    """Run ``sql`` and return the first column of its first row."""
+    if label is None:
+        label = ' '.join(sql.split())[:60]
+    start = time.perf_counter()
+    value = connection(db_path).execute(sql, params or {}).fetchone()[0]
+    _record(label, time.perf_counter() - start, 1)
+    return value
+
+
+def stats():
+    """Per-label query count, rows returned and total/max seconds."""
+    with _stats_lock:
+        return {label: dict(entry) for label, entry in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
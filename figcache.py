@@ -0,0 +1,150 @@
+"""Server-side cache of callback results.
+
+Most callbacks map a handful of dropdown values to a Plotly figure, and the
+same few combinations come back over and over across users. ``cached()``
+memoises a callback on its normalised inputs so a repeat view skips the
+aggregation and the ``px`` figure construction:
+
+    @app.callback(...)
+    @figcache.cached()
+    def update_chart(selected_city, selected_segment):
+        ...
+
+Each callback gets its own LRU of at most ``maxsize`` results. Entries are
+tied to the data snapshot they were built from and the whole cache is
+dropped as soon as ``data.version()`` changes. ``stats()`` reports the hit
+and miss counters of every cache.
+
+``wrapper.warm(*args)`` fills the cache without counting as a request, and
+``FigureCache.requests`` counts how often each key was asked for; the
+``precompute`` scheduler uses both to build the popular results ahead of time.
+"""
+import functools
+import threading
+from collections import Counter, OrderedDict
+
+import data
+
+DEFAULT_MAXSIZE = 256
+
+# Distinct keys whose requests are counted per cache (multi-selects make the key space open-ended)
+MAX_COUNTED_KEYS = 4096
+
+_caches = {}
+
+# Whether the last cached() call of each thread was answered from its cache
+_local = threading.local()
+
+
+def normalize(value):
+    """Make a callback input hashable; multi-select values ignore their order."""
+    if isinstance(value, (list, tuple)):
+        try:
+            return tuple(sorted(value))
+        except TypeError:
+            return tuple(value)
+    return value
+
+
+class FigureCache:
+    """A thread-safe LRU with hit/miss counters, bound to one data version."""
+
+    def __init__(self, name, maxsize=DEFAULT_MAXSIZE):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.requests = Counter()
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self.requests or len(self.requests) < MAX_COUNTED_KEYS:
+                self.requests[key] += 1
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def has(self, key, version):
+        """Whether ``key`` is cached for ``version``, without counting a hit or a miss."""
+        with self._lock:
+            return version == self._version and key in self._entries
+
+    def put(self, key, value, version):
+        with self._lock:
+            # Versions only go up: a newer one replaces the cache (as get() would),
+            # a result built from a snapshot that has since been replaced is dropped
+            if self._version is None or version > self._version:
+                self._entries.clear()
+                self._version = version
+            elif version != self._version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+def cached(maxsize=DEFAULT_MAXSIZE):
+    """Memoise a Dash callback on its inputs and the current data version."""
+    def decorate(func):
+        cache = _caches[func.__name__] = FigureCache(func.__name__, maxsize)
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = tuple(normalize(arg) for arg in args)
+            version = data.version()
+            try:
+                result = cache.get(key, version)
+                _local.hit = True
+                return result
+            except KeyError:
+                _local.hit = False
+            result = func(*args)
+            cache.put(key, result, version)
+            return result
+
+        def warm(*args):
+            """Compute and cache the result for ``args`` unless it is there; True if it was computed."""
+            key = tuple(normalize(arg) for arg in args)
+            version = data.version()
+            if cache.has(key, version):
+                return False
+            cache.put(key, func(*args), version)
+            return True
+
+        wrapper.cache = cache
+        wrapper.warm = warm
+        return wrapper
+    return decorate
+
+
+def stats():
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def last_hit():
+    """Whether this thread's last call to a cached callback was a cache hit."""
+    return getattr(_local, 'hit', False)
+
+
+def clear():
+    for cache in _caches.values():
+        cache.clear()
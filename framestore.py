@@ -0,0 +1,167 @@
+"""On-disk cache of the derived data frames, keyed on the database state.
+
+Parsing the text dates and re-running the queries is most of what a cold
+start costs, so once a snapshot is built its frames are written out as typed
+columns and the next process loads them instead. Each frame is a directory
+of ``.npy`` files, one per column, plus a ``frame.json`` describing them:
+
+* numeric, bool and datetime64 columns are saved as they are
+* categoricals as their integer codes plus their categories (as a column)
+* strings as one UTF-8 buffer with int64 offsets and a missing-value mask
+
+A cache entry lives in ``<directory>/<key>/`` next to a ``manifest.json``
+holding the watermarks it was built at. Entries are written to a temporary
+directory and renamed into place, so a reader never sees half of one, and
+older entries are removed once a new one is complete.
+
+Loaded with ``mmap=True``, numeric columns and categorical codes are
+read-only views of the files: every process mapping the same entry shares
+one copy in the page cache instead of holding its own. Plain NumPy files are
+used instead of Parquet/Arrow so the cache needs nothing beyond
+``requirements.txt``.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of a persisted dataset changes
+FORMAT_VERSION = 4
+
+
+def file_state(db_path):
+    """Device, inode, size and mtime of the database file and of its write-ahead log.
+
+    Any write changes one of them, so two equal states mean the same
+    contents without reading the file. An empty or missing log counts the
+    same, as readers create and remove it.
+    """
+    state = []
+    for path in (db_path, db_path + '-wal'):
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if info.st_size or path == db_path:
+            state.append([info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns])
+    return state
+
+
+def fingerprint(state, watermarks):
+    """Key for the frames built at ``watermarks`` from a database in ``file_state`` ``state``."""
+    text = json.dumps({'file': state, 'watermarks': watermarks}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _save_column(directory, name, values):
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        np.save(os.path.join(directory, f'{name}.codes.npy'), values.cat.codes.to_numpy())
+        categories = _save_column(directory, f'{name}.categories', pd.Series(dtype.categories))
+        return {'kind': 'categorical', 'ordered': bool(dtype.ordered), 'categories': categories}
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM':
+        np.save(os.path.join(directory, f'{name}.npy'), values.to_numpy())
+        return {'kind': 'array'}
+    if pd.api.types.is_string_dtype(dtype):
+        missing = values.isna().to_numpy()
+        encoded = [b'' if is_missing else value.encode('utf-8') for value, is_missing in zip(values.to_numpy(object), missing)]
+        offsets = np.zeros(len(encoded) + 1, dtype='int64')
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        np.save(os.path.join(directory, f'{name}.data.npy'), np.frombuffer(b''.join(encoded), dtype='uint8'))
+        np.save(os.path.join(directory, f'{name}.offsets.npy'), offsets)
+        np.save(os.path.join(directory, f'{name}.missing.npy'), missing)
+        return {'kind': 'string', 'dtype': str(dtype)}
+    raise TypeError(f"Cannot store a column of dtype {dtype}")
+
+
+def _load_column(directory, name, spec, mmap_mode):
+    if spec['kind'] == 'categorical':
+        codes = np.load(os.path.join(directory, f'{name}.codes.npy'), mmap_mode=mmap_mode)
+        categories = _load_column(directory, f'{name}.categories', spec['categories'], None)
+        return pd.Categorical.from_codes(codes, categories=pd.Index(categories), ordered=spec['ordered'])
+    if spec['kind'] == 'array':
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+    buffer = np.load(os.path.join(directory, f'{name}.data.npy')).tobytes()
+    offsets = np.load(os.path.join(directory, f'{name}.offsets.npy')).tolist()
+    missing = np.load(os.path.join(directory, f'{name}.missing.npy'))
+    values = [None if is_missing else buffer[start:end].decode('utf-8')
+              for start, end, is_missing in zip(offsets[:-1], offsets[1:], missing)]
+    return pd.array(values, dtype=spec['dtype'])
+
+
+def save_frame(directory, frame):
+    os.makedirs(directory)
+    index = []
+    if not frame.index.equals(pd.RangeIndex(len(frame))):
+        #Unnamed index levels get placeholder names while they are stored as columns
+        index = [name if name is not None else f'__index_{level}__' for level, name in enumerate(frame.index.names)]
+        frame = frame.rename_axis(index).reset_index()
+    columns = []
+    for position, column in enumerate(frame.columns):
+        spec = _save_column(directory, str(position), frame[column])
+        columns.append({'name': column, **spec})
+    with open(os.path.join(directory, 'frame.json'), 'w') as file:
+        json.dump({'columns': columns, 'index': index}, file)
+
+
+def load_frame(directory, mmap=False):
+    """Load a frame; with ``mmap`` its numeric columns and codes stay views of the files."""
+    with open(os.path.join(directory, 'frame.json')) as file:
+        layout = json.load(file)
+    mmap_mode = 'r' if mmap else None
+    frame = pd.DataFrame({
+        spec['name']: _load_column(directory, str(position), spec, mmap_mode)
+        for position, spec in enumerate(layout['columns'])
+    }, copy=not mmap)
+    if layout['index']:
+        frame = frame.set_index(layout['index'])
+        frame.index.names = [None if name.startswith('__index_') else name for name in layout['index']]
+    return frame
+
+
+def save(directory, key, watermarks, frames):
+    """Write ``frames`` (name -> DataFrame) as the entry for ``key``, replacing older entries.
+
+    An existing entry for ``key`` is left alone (another process got there
+    first), as workers may already have its files mapped.
+    """
+    os.makedirs(directory, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=directory)
+    try:
+        for name, frame in frames.items():
+            save_frame(os.path.join(staging, name), frame)
+        with open(os.path.join(staging, 'manifest.json'), 'w') as file:
+            json.dump({'format': FORMAT_VERSION, 'watermarks': watermarks, 'frames': sorted(frames)}, file)
+        os.rename(staging, os.path.join(directory, key))
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.exists(os.path.join(directory, key, 'manifest.json')):
+            raise
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    # Mapped files of removed entries stay readable until they are unmapped
+    for entry in os.listdir(directory):
+        if entry != key and not entry.startswith('.staging-'):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+
+def load(directory, key, mmap=False):
+    """Return ``(watermarks, frames)`` stored for ``key``, or None if there is no such entry."""
+    entry = os.path.join(directory, key)
+    try:
+        with open(os.path.join(entry, 'manifest.json')) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    if manifest['format'] != FORMAT_VERSION:
+        return None
+    frames = {name: load_frame(os.path.join(entry, name), mmap) for name in manifest['frames']}
+    return manifest['watermarks'], frames
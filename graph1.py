@@ -0,0 +1,79 @@
+"""Precomputed distinct-seller counts behind the Graph 1 line chart.
+
+The chart shows, for each month of ``MONTHS``, how many distinct sellers won
+a deal, optionally restricted to one city and/or one business segment. The
+index holds that row of counts for every (city, segment) pair in ``gr2_df``
+and for the all-cities and all-segments rollups. Each rollup runs its own
+``nunique`` over the deal rows rather than summing finer cells, so the counts
+stay exact when a seller shows up in several cities or segments.
+"""
+import numpy as np
+import pandas as pd
+
+# Months on the x axis of the Graph 1 line chart
+MONTHS = pd.date_range(start='2018-01-01', end='2018-08-31', freq='ME').strftime('%Y-%m').tolist()
+
+
+# Groupings the index holds counts for; () is all cities and all segments
+GROUPINGS = [('city', 'segment'), ('city',), ('segment',), ()]
+
+
+class SellerMonthIndex:
+    """Distinct sellers per month for every (city, segment) filter.
+
+    ``cities`` and ``segments`` list every value of ``gr2_df`` in sorted
+    order (as ``sqlengine.SQL_CITIES``/``SQL_SEGMENTS`` return them), for
+    the Graph 1 dropdowns.
+    """
+
+    def __init__(self, gr2_df, months=MONTHS):
+        frame = gr2_df[gr2_df['month'].isin(months) & gr2_df['seller_id'].notna()]
+        frame = pd.DataFrame({
+            'city': frame['seller_city'],
+            'segment': frame['business_segment'],
+            'month': frame['month'],
+            'seller_id': frame['seller_id'],
+        })
+        counts = {}
+        for by in GROUPINGS:
+            counts[by] = frame.dropna(subset=list(by)).groupby(list(by) + ['month'])['seller_id'].nunique()
+        cities = sorted(gr2_df['seller_city'].dropna().unique())
+        segments = sorted(gr2_df['business_segment'].dropna().unique())
+        self._load(counts, cities, segments, months)
+
+    @classmethod
+    def from_counts(cls, counts, cities, segments, months=MONTHS):
+        """Build the index from already aggregated counts.
+
+        ``counts`` maps every grouping of ``GROUPINGS`` to a Series of distinct
+        seller counts indexed by the grouping columns and ``month``.
+        """
+        index = cls.__new__(cls)
+        index._load(counts, cities, segments, months)
+        return index
+
+    def _load(self, counts, cities, segments, months):
+        self.months = list(months)
+        self.cities = list(cities)
+        self.segments = list(segments)
+        self._zeros = self._read_only(np.zeros(len(self.months), dtype='int64'))
+        self._counts = {}
+        for by, grouped in counts.items():
+            if not by:
+                #All cities and all segments
+                total = grouped.reindex(self.months, fill_value=0)
+                self._counts[None, None] = self._read_only(total.to_numpy(dtype='int64'))
+                continue
+            table = grouped.unstack('month', fill_value=0).reindex(columns=self.months, fill_value=0)
+            for key, row in zip(table.index, self._read_only(table.to_numpy(dtype='int64'))):
+                key = dict(zip(by, key if len(by) > 1 else (key,)))
+                self._counts[key.get('city'), key.get('segment')] = row
+
+    @staticmethod
+    def _read_only(values):
+        values.flags.writeable = False
+        return values
+
+    def get(self, city=None, segment=None):
+        """Return the (read-only) distinct seller count of every month."""
+        return self._counts.get((city or None, segment or None), self._zeros)
@@ -0,0 +1,251 @@
+"""Precomputed aggregates behind the Graph 4 callbacks.
+
+A seller's age category only depends on the cut-off month and on the date the
+seller joined, so the orders are reduced once to per-seller totals (and
+per-seller, per-``transaction_age_mark`` totals) for every join date; new
+orders are folded in with ``combine``. The cube then holds, for each of the
+fixed cut-off months in the ``order-month`` dropdown and each ``seller-age``
+option, the table every chart reads from. A request is a dictionary lookup
+instead of a pass over the orders table.
+"""
+import copy
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import bucketing
+import columnar
+
+# Values offered by the `order-month` dropdown
+CUT_OFF_MONTHS = pd.date_range(start='2018-01', end='2018-12-31', freq='ME').strftime('%Y-%m-%d').tolist()
+
+# Values offered by the `seller-age` dropdown
+SELLER_AGES = ["1 month", "2 months", "3 months"]
+
+# Default number of sellers in the Top/Lowest Performing panels
+TOP_K = 10
+
+# Most options the Seller ID dropdown is sent at once
+SELLER_OPTIONS = 50
+
+# Most selected sellers drawn as their own lines in the trend charts
+TREND_SELLERS = 50
+
+# Percentiles across sellers shaded in the default trend charts, outermost
+# band first; the median is drawn as a line on top
+TREND_BANDS = [(10, 90), (25, 75)]
+
+# totals: one row per seller, with the summed `amount` and the `order_id` count
+# leaderboard: the sellers of `totals` ranked for the performer panels, see Leaderboard
+# trend:  one row per seller and transaction_age_mark (without "Old seller"),
+#         sorted by transaction_age_mark the way the trend charts expect
+# sellers: the sellers in `trend`, as a SellerIndex
+# bands:  the spread of `trend` across sellers per transaction_age_mark, see trend_bands
+Graph4Slice = namedtuple('Graph4Slice', ['totals', 'leaderboard', 'trend', 'sellers', 'bands'])
+
+# Largest (top_*) and smallest (bottom_*) sellers by amount and by order count,
+# each a [seller_id, amount] or [seller_id, order_id] frame
+Performers = namedtuple('Performers', ['top_amount', 'top_count', 'bottom_amount', 'bottom_count'])
+
+
+def _ranking(values, descending):
+    #Stable, so ties keep the seller that comes first in totals (ordered by seller_id)
+    return np.argsort(-values if descending else values, kind='stable')
+
+
+class Leaderboard:
+    """The sellers of a per-seller totals table, pre-sorted by amount and by order count.
+
+    Sorting happens once per slice, so ``performers(k)`` is ``O(k)`` for any
+    ``k`` and picks the same sellers as ``nlargest``/``nsmallest`` would.
+    """
+
+    def __init__(self, totals):
+        self._amount = totals[['seller_id', 'amount']]
+        self._count = totals[['seller_id', 'order_id']]
+        amount = totals['amount'].to_numpy()
+        count = totals['order_id'].to_numpy()
+        self._top_amount = _ranking(amount, descending=True)
+        self._top_count = _ranking(count, descending=True)
+        self._bottom_amount = _ranking(amount, descending=False)
+        self._bottom_count = _ranking(count, descending=False)
+
+    def __len__(self):
+        return len(self._amount)
+
+    def performers(self, k=TOP_K):
+        """The top and lowest ``k`` sellers as ``Performers``."""
+        return Performers(
+            top_amount=self._amount.iloc[self._top_amount[:k]],
+            top_count=self._count.iloc[self._top_count[:k]],
+            bottom_amount=self._amount.iloc[self._bottom_amount[:k]],
+            bottom_count=self._count.iloc[self._bottom_count[:k]],
+        )
+
+
+class SellerIndex:
+    """The seller IDs of a slice, sorted for prefix search.
+
+    The matches of a prefix are a contiguous run of the sorted IDs, found by
+    binary search, so a search costs ``O(log n + limit)`` however many
+    sellers the slice has.
+    """
+
+    def __init__(self, seller_ids):
+        self._ids = np.sort(np.asarray(seller_ids, dtype=object))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, seller_id):
+        position = np.searchsorted(self._ids, seller_id)
+        return position < len(self._ids) and self._ids[position] == seller_id
+
+    def search(self, prefix='', limit=SELLER_OPTIONS):
+        """Up to ``limit`` seller IDs starting with ``prefix``, in order."""
+        start = np.searchsorted(self._ids, prefix)
+        matches = []
+        for seller_id in self._ids[start:start + limit]:
+            if not seller_id.startswith(prefix):
+                break
+            matches.append(seller_id)
+        return matches
+
+
+def trend_bands(trend):
+    """Percentiles of a slice's ``trend`` across sellers, per transaction_age_mark.
+
+    One row per mark, in the order of ``trend``, with the number of
+    ``sellers`` and an ``<measure>_p<percentile>`` column for the median and
+    every percentile of ``TREND_BANDS``, for both ``amount`` and ``order_id``.
+    Its size depends on the number of marks only, not on the number of sellers.
+    """
+    percentiles = sorted({50, *(percentile for band in TREND_BANDS for percentile in band)})
+    grouped = trend.groupby('transaction_age_mark', observed=True, sort=False)
+    bands = grouped.size().rename('sellers').to_frame()
+    for measure in ('amount', 'order_id'):
+        for percentile in percentiles:
+            bands[f'{measure}_p{percentile}'] = grouped[measure].quantile(percentile / 100)
+    bands = bands.reset_index()
+    bands['transaction_age_mark'] = bands['transaction_age_mark'].astype(str)
+    return bands
+
+
+def _happened(order_new_seller):
+    #Only the transactions that already happened are shown in Graph 4
+    return order_new_seller[order_new_seller['trx_happened'].cat.codes.to_numpy() == 0]
+
+
+def seller_totals(order_new_seller):
+    """Summed ``amount`` and ``order_id`` count per seller and join date.
+
+    won_date is kept in the keys so that the age category can be derived per
+    row later; seller_id stays dictionary-encoded, so this groups by codes.
+    """
+    return (
+        _happened(order_new_seller).groupby(['seller_id', 'won_date'], observed=True, dropna=False)
+        .agg(amount=('amount', 'sum'), order_id=('order_id', 'count'))
+        .reset_index()
+    )
+
+
+def seller_trend(order_new_seller):
+    """Like ``seller_totals``, per ``transaction_age_mark`` as well."""
+    return (
+        _happened(order_new_seller).groupby(['seller_id', 'won_date', 'transaction_age_mark'], observed=True, dropna=False)
+        .agg(amount=('amount', 'sum'), order_id=('order_id', 'count'))
+        .reset_index()
+    )
+
+
+def combine(reduced, *more):
+    """Add up ``seller_totals``/``seller_trend`` tables, e.g. a previous one and a delta's."""
+    keys = [column for column in reduced.columns if column not in ('amount', 'order_id')]
+    return (
+        columnar.concat([reduced, *more])
+        .groupby(keys, observed=True, dropna=False)
+        .agg(amount=('amount', 'sum'), order_id=('order_id', 'sum'))
+        .reset_index()
+    )
+
+
+def _age_code(seller_age):
+    return bucketing.AGE_CATEGORIES.index(seller_age) if seller_age in bucketing.AGE_CATEGORIES else -1
+
+
+class Graph4Cube:
+    """Per (cut-off month, seller age) aggregates of the ``seller_totals``/``seller_trend`` tables."""
+
+    def __init__(self, totals, trend, cut_off_months=CUT_OFF_MONTHS, seller_ages=SELLER_AGES):
+        self.cut_off_months = cut_off_months
+        self.seller_ages = seller_ages
+        self._totals = totals
+        self._trend = trend
+        self._slices = {
+            (cut_off_month, seller_age): self._build_slice(cut_off_month, seller_age)
+            for cut_off_month in cut_off_months
+            for seller_age in seller_ages
+        }
+
+    def updated(self, totals, trend, new_totals, new_trend):
+        """Return the cube of ``totals``/``trend``, which add ``new_totals``/``new_trend`` to this one's tables.
+
+        Only the slices that the new rows fall into are rebuilt (and their
+        leaderboards sorted again); the others are shared with this cube.
+        """
+        cube = self.rebased(totals, trend)
+        for cut_off_month, seller_age in self._slices:
+            cut_off_date = np.datetime64(pd.to_datetime(cut_off_month))
+            age_code = _age_code(seller_age)
+            touched = (
+                (bucketing.age_category_codes(cut_off_date, new_totals['won_date']) == age_code).any()
+                or (bucketing.age_category_codes(cut_off_date, new_trend['won_date']) == age_code).any()
+            )
+            if touched:
+                cube._slices[(cut_off_month, seller_age)] = cube._build_slice(cut_off_month, seller_age)
+        return cube
+
+    def rebased(self, totals, trend):
+        """The same cube over other copies of its tables (e.g. memory-mapped ones)."""
+        cube = copy.copy(self)
+        cube._totals = totals
+        cube._trend = trend
+        cube._slices = dict(self._slices)
+        return cube
+
+    def get(self, cut_off_month, seller_age):
+        """Return the ``Graph4Slice`` for a cut-off month and seller age category.
+
+        Combinations outside the dropdown values are computed from the reduced
+        per-seller tables, which is still independent of the number of orders.
+        """
+        found = self._slices.get((cut_off_month, seller_age))
+        if found is None:
+            found = self._build_slice(cut_off_month, seller_age)
+        return found
+
+    def _build_slice(self, cut_off_month, seller_age):
+        cut_off_date = np.datetime64(pd.to_datetime(cut_off_month))
+        age_code = _age_code(seller_age)
+
+        #Sellers with more than one closed deal are summed over all of their deals in the category
+        totals = self._totals[bucketing.age_category_codes(cut_off_date, self._totals['won_date']) == age_code]
+        totals = (
+            totals.groupby('seller_id', observed=True)
+            .agg(amount=('amount', 'sum'), order_id=('order_id', 'sum'))
+            .reset_index()
+        )
+        totals['seller_id'] = columnar.decode(totals['seller_id'])
+
+        trend = self._trend[bucketing.age_category_codes(cut_off_date, self._trend['won_date']) == age_code]
+        trend = (
+            trend.groupby(['seller_id', 'transaction_age_mark'], observed=True)
+            .agg(amount=('amount', 'sum'), order_id=('order_id', 'sum'))
+            .reset_index()
+        )
+        trend['seller_id'] = columnar.decode(trend['seller_id'])
+        trend = trend.sort_values(by='transaction_age_mark', ascending=True)
+        trend = trend[trend['transaction_age_mark'] != 'Old seller']
+
+        return Graph4Slice(totals, Leaderboard(totals), trend, SellerIndex(trend['seller_id'].unique()), trend_bands(trend))
@@ -0,0 +1,40 @@
+# Gunicorn settings, picked up automatically from the working directory
+# (Procfile: `gunicorn app:server`).
+import os
+
+# Import the app once in the master and build every dataset there before the
+# workers are forked, so each worker starts warm instead of re-reading
+# olist_PDDS.sqlite on boot. The frames are memory-mapped from the snapshot
+# cache (see data.py), so adding workers adds little memory.
+preload_app = True
+
+# The callbacks only read the shared frames, so a worker can serve several
+# requests at once.
+worker_class = 'gthread'
+threads = 4
+
+# Seconds between checks for rows appended to olist_PDDS.sqlite; each worker
+# folds them into its data and swaps it in without a restart (0 turns it off)
+refresh_interval = float(os.environ.get('OLIST_REFRESH_INTERVAL', '0'))
+
+
+def when_ready(server):
+    import data
+
+    try:
+        data.warm()
+    except Exception:
+        # Workers still come up and build what they need on first request
+        server.log.exception("Could not preload dashboard data")
+
+
+def post_fork(server, worker):
+    if refresh_interval > 0:
+        import data
+
+        data.start_auto_refresh(refresh_interval)
+
+    # Threads don't survive the fork, so each worker warms its own figure cache
+    import precompute
+
+    precompute.start()
@@ -0,0 +1,247 @@
+"""Per-callback latency and payload metrics.
+
+Wrap a callback with ``instrumented`` (under ``@app.callback``, above
+``@figcache.cached``) and ``init_app(server)`` records, for every call:
+
+* the wall time of the callback, split into ``aggregate`` (the blocks under
+  ``with metrics.phase('aggregate'):``) and ``figure`` (the rest of it)
+* ``serialize``: the rest of the request, mostly Dash encoding the outputs
+* the response size in bytes, and whether ``figcache`` had the result
+
+``/metrics`` on the Flask server exposes the totals in the Prometheus text
+format, next to the ``figcache`` hit/miss counters, the ``db`` query
+timings and the progress of the ``precompute`` warm-up. The request
+durations are a Prometheus histogram, so ``histogram_quantile`` gives their
+p50/p99. The numbers are per process, so each gunicorn worker reports its
+own. Set ``OLIST_METRICS=0`` to turn it all off; when on, a call costs a few
+``perf_counter()`` calls and one locked update.
+
+Every request is also logged as one JSON line on the ``metrics`` logger at
+INFO. ``init_app`` sets that level and, when logging is not configured
+otherwise (no handler on it or the root logger, as under gunicorn), sends
+the lines to stderr. Set ``OLIST_METRICS_LOG=0`` to leave the logger alone.
+"""
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import flask
+
+import db
+import figcache
+import precompute
+
+ENABLED = os.environ.get('OLIST_METRICS', '1') == '1'
+
+# Log every request on the ``metrics`` logger (see the module docstring)
+LOG_REQUESTS = os.environ.get('OLIST_METRICS_LOG', '1') == '1'
+
+PHASES = ['aggregate', 'figure', 'serialize']
+
+# Upper bounds (in seconds) of the request duration histogram
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+DASH_UPDATE_PATH = '/_dash-update-component'
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stats = {}
+_local = threading.local()
+
+
+class _Call:
+    __slots__ = ['name', 'aggregate', 'callback', 'cache_hit']
+
+    def __init__(self, name):
+        self.name = name
+        self.aggregate = 0.0
+        self.callback = 0.0
+        self.cache_hit = False
+
+
+def _new_stats():
+    return {
+        'calls': 0,
+        'cache_hits': 0,
+        'seconds': dict.fromkeys(PHASES, 0.0),
+        'total_seconds': 0.0,
+        'max_seconds': 0.0,
+        'bytes': 0,
+        'max_bytes': 0,
+        'buckets': [0] * len(BUCKETS),
+    }
+
+
+def _record(call, total, size):
+    seconds = {
+        'aggregate': call.aggregate,
+        'figure': max(call.callback - call.aggregate, 0.0),
+        'serialize': max(total - call.callback, 0.0),
+    }
+    with _lock:
+        stats = _stats.setdefault(call.name, _new_stats())
+        stats['calls'] += 1
+        stats['cache_hits'] += call.cache_hit
+        for phase, value in seconds.items():
+            stats['seconds'][phase] += value
+        stats['total_seconds'] += total
+        stats['max_seconds'] = max(stats['max_seconds'], total)
+        stats['bytes'] += size
+        stats['max_bytes'] = max(stats['max_bytes'], size)
+        for i, bound in enumerate(BUCKETS):
+            if total <= bound:
+                stats['buckets'][i] += 1
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            'callback': call.name,
+            'cache_hit': call.cache_hit,
+            'total_ms': round(total * 1000, 3),
+            **{f'{phase}_ms': round(value * 1000, 3) for phase, value in seconds.items()},
+            'bytes': size,
+        }))
+
+
+def instrumented(func):
+    """Time a Dash callback; see the module docstring."""
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        call = _local.call = _Call(func.__name__)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            call.callback = time.perf_counter() - start
+            call.cache_hit = hasattr(func, 'cache') and figcache.last_hit()
+            if not flask.has_request_context():
+                # Called directly rather than through Dash: nothing to serialize
+                _local.call = None
+                _record(call, call.callback, 0)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Count the time spent in the block towards ``name`` (only 'aggregate' for now)."""
+    call = getattr(_local, 'call', None)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if call is not None:
+            setattr(call, name, getattr(call, name) + time.perf_counter() - start)
+
+
+def stats():
+    with _lock:
+        return {name: {**entry, 'seconds': dict(entry['seconds']), 'buckets': list(entry['buckets'])}
+                for name, entry in _stats.items()}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def sample(name, labels, value):
+        label_text = ','.join(f'{key}="{_label(val)}"' for key, val in labels.items())
+        lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            sample(name, labels, value)
+
+    callbacks = stats()
+    metric('olist_callback_calls_total', 'counter', 'Dash callback calls.',
+           [({'callback': name}, entry['calls']) for name, entry in callbacks.items()])
+    metric('olist_callback_cache_hits_total', 'counter', 'Dash callback calls answered from figcache.',
+           [({'callback': name}, entry['cache_hits']) for name, entry in callbacks.items()])
+    metric('olist_callback_phase_seconds_total', 'counter', 'Time spent per phase of the Dash callbacks.',
+           [({'callback': name, 'phase': phase_name}, entry['seconds'][phase_name])
+            for name, entry in callbacks.items() for phase_name in PHASES])
+    metric('olist_callback_max_seconds', 'gauge', 'Slowest Dash callback request.',
+           [({'callback': name}, entry['max_seconds']) for name, entry in callbacks.items()])
+    metric('olist_callback_response_bytes_total', 'counter', 'Bytes of the Dash callback responses.',
+           [({'callback': name}, entry['bytes']) for name, entry in callbacks.items()])
+    metric('olist_callback_max_response_bytes', 'gauge', 'Largest Dash callback response.',
+           [({'callback': name}, entry['max_bytes']) for name, entry in callbacks.items()])
+
+    #One histogram family: cumulative _bucket counts, then _sum and _count
+    histogram = 'olist_callback_duration_seconds'
+    lines.append(f'# HELP {histogram} Duration of the Dash callback requests.')
+    lines.append(f'# TYPE {histogram} histogram')
+    for name, entry in callbacks.items():
+        for bound, count in zip(BUCKETS, entry['buckets']):
+            sample(f'{histogram}_bucket', {'callback': name, 'le': bound}, count)
+        sample(f'{histogram}_bucket', {'callback': name, 'le': '+Inf'}, entry['calls'])
+        sample(f'{histogram}_sum', {'callback': name}, entry['total_seconds'])
+        sample(f'{histogram}_count', {'callback': name}, entry['calls'])
+
+    caches = figcache.stats()
+    metric('olist_figcache_hits_total', 'counter', 'figcache hits.',
+           [({'cache': name}, entry['hits']) for name, entry in caches.items()])
+    metric('olist_figcache_misses_total', 'counter', 'figcache misses.',
+           [({'cache': name}, entry['misses']) for name, entry in caches.items()])
+
+    warm_up = precompute.status()
+    metric('olist_precompute_tasks', 'gauge', 'Results to warm for the current data version.',
+           [({'state': state}, warm_up[state]) for state in ('total', 'done', 'failed')])
+    metric('olist_precompute_finished', 'gauge', 'Whether the warm-up of the current data version finished.',
+           [({}, int(warm_up['finished']))])
+    metric('olist_precompute_seconds', 'gauge', 'Duration of the last finished warm-up.',
+           [({}, warm_up['seconds'])])
+
+    queries = db.stats()
+    metric('olist_db_queries_total', 'counter', 'SQLite queries.',
+           [({'query': label}, entry['count']) for label, entry in queries.items()])
+    metric('olist_db_query_seconds_total', 'counter', 'Time spent in SQLite queries.',
+           [({'query': label}, entry['total']) for label, entry in queries.items()])
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(server):
+    """Add the request hooks and the ``/metrics`` route to the Flask ``server``."""
+    @server.route('/metrics')
+    def prometheus_metrics():
+        return flask.Response(render(), mimetype='text/plain; version=0.0.4')
+
+    if not ENABLED:
+        return
+
+    if LOG_REQUESTS:
+        logger.setLevel(logging.INFO)
+        if not logger.handlers and not logging.getLogger().handlers:
+            logger.addHandler(logging.StreamHandler())
+
+    @server.before_request
+    def start_timer():
+        if flask.request.path.endswith(DASH_UPDATE_PATH):
+            _local.call = None
+            flask.g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def record_request(response):
+        start = flask.g.pop('metrics_start', None)
+        call = getattr(_local, 'call', None)
+        if start is not None and call is not None:
+            _local.call = None
+            _record(call, time.perf_counter() - start, response.calculate_content_length() or 0)
+        return response
@@ -0,0 +1,147 @@
+"""Background warm-up of the callback results the dashboard serves.
+
+``data.warm()`` builds the datasets, but every callback still builds its
+figure the first time a combination of dropdown values is asked for, and
+``figcache`` forgets them all when the data is refreshed. The scheduler
+computes them ahead of time instead:
+
+    precompute.register(update_chart_4_1, lambda: [(month, age) for ...])
+    precompute.start()
+
+``register`` takes a ``figcache.cached`` callback and a function returning
+the argument tuples to warm (called on every run, as they can depend on the
+data). ``start()`` runs a daemon thread that warms them in a small thread
+pool when it starts and again whenever ``data.version()`` changes, so a user
+only waits on a combination nobody warmed. The combinations requested most
+often (``FigureCache.requests``) go first, the rest follow in registration
+order, and each callback gets at most its cache size of them.
+
+Threads rather than processes, as the results have to end up in this
+process's ``figcache``. ``status()`` tells how far the current run is,
+``wait()`` blocks until it is done and a log line reports when it finishes.
+Set ``OLIST_PRECOMPUTE=0`` to turn it off.
+"""
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+import data
+import figcache
+
+ENABLED = os.environ.get('OLIST_PRECOMPUTE', '1') == '1'
+
+# Worker threads computing the results
+THREADS = int(os.environ.get('OLIST_PRECOMPUTE_THREADS', '2'))
+
+# Seconds between checks for a new data version
+POLL_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+_jobs = []
+_lock = threading.Lock()
+_status = {'version': None, 'total': 0, 'done': 0, 'failed': 0, 'finished': False, 'seconds': 0.0}
+_finished = threading.Condition(_lock)
+_stop = threading.Event()
+_thread = None
+
+
+def register(callback, arguments):
+    """Warm ``callback`` (a ``figcache.cached`` function) for every tuple of ``arguments()``."""
+    _jobs.append((callback, arguments))
+    return callback
+
+
+def plan():
+    """``(callback, args)`` pairs to warm for the current data, most requested first."""
+    ranked, rest = [], []
+    for order, (callback, arguments) in enumerate(_jobs):
+        cache = callback.cache
+        counts = dict(cache.requests)
+        tasks = [(counts.get(tuple(figcache.normalize(arg) for arg in args), 0), order, position, callback, tuple(args))
+                 for position, args in enumerate(arguments())]
+        #Popular keys first, and no more than the cache keeps
+        tasks.sort(key=lambda task: -task[0])
+        for task in tasks[:cache.maxsize]:
+            (ranked if task[0] else rest).append(task)
+    ranked.sort(key=lambda task: (-task[0], task[1], task[2]))
+    return [(task[3], task[4]) for task in ranked + rest]
+
+
+def _warm(version, callback, args):
+    #Results of a replaced snapshot would be dropped by figcache anyway
+    if data.version() != version:
+        return False
+    return callback.warm(*args)
+
+
+def run_once():
+    """Warm everything for the current data version; returns the number of results computed."""
+    version = data.version()
+    tasks = plan()
+    start = time.perf_counter()
+    with _lock:
+        _status.update(version=version, total=len(tasks), done=0, failed=0, finished=False, seconds=0.0)
+    computed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='precompute') as pool:
+        futures = [pool.submit(_warm, version, callback, args) for callback, args in tasks]
+        for future, (callback, args) in zip(futures, tasks):
+            try:
+                computed += bool(future.result())
+            except Exception:
+                logger.exception("Precomputing %s%r failed", callback.__name__, args)
+                with _lock:
+                    _status['failed'] += 1
+            with _lock:
+                _status['done'] += 1
+    seconds = time.perf_counter() - start
+    with _lock:
+        _status.update(finished=True, seconds=seconds)
+        _finished.notify_all()
+    logger.info("Precomputed %d of %d results for data version %s in %.2fs", computed, len(tasks), version, seconds)
+    return computed
+
+
+def status():
+    with _lock:
+        return dict(_status)
+
+
+def wait(timeout=None):
+    """Block until the run for the current data version is finished; False on timeout."""
+    #Not under _lock: data.version() can wait for a snapshot to be built,
+    #and status() and the /metrics scrape would wait with it. Versions only
+    #grow, so a finished run of a newer one counts too
+    version = data.version()
+    with _lock:
+        return _finished.wait_for(lambda: _status['finished'] and (_status['version'] or 0) >= version, timeout)
+
+
+def start():
+    """Run the scheduler in a daemon thread (once per process; a no-op when disabled)."""
+    global _thread
+    if not ENABLED or (_thread is not None and _thread.is_alive()):
+        return _thread
+
+    def loop():
+        warmed = None
+        while not _stop.is_set():
+            version = data.version()
+            if version != warmed:
+                try:
+                    run_once()
+                except Exception:
+                    logger.exception("Precomputing the dashboard views failed")
+                warmed = version
+            _stop.wait(POLL_INTERVAL)
+
+    _stop.clear()
+    _thread = threading.Thread(target=loop, name='precompute', daemon=True)
+    _thread.start()
+    return _thread
+
+
+def stop():
+    _stop.set()
@@ -0,0 +1,145 @@
+"""Optional SQLite query engine for the Graph 1-4 aggregations.
+
+By default the data layer pulls whole tables into pandas and joins and
+groups them there. With ``OLIST_QUERY_ENGINE=sqlite`` the joins and GROUP BYs
+below run inside SQLite instead and only their (small) results are loaded,
+so ``olist_PDDS.sqlite`` can be far larger than memory:
+
+* Graph 1: distinct sellers per (city, segment, month) and their rollups
+* Graph 2: deals per (business segment, month)
+* Graph 3: new/old sellers per state
+* Graph 4: the delivered orders of the sellers in ``closed_deals``
+
+The queries take the same ``:<table>_lo``/``:<table>_hi`` watermark
+parameters as the rest of the data layer and run through ``db``.
+``ensure_indexes()`` creates the indexes they rely on.
+
+Months are sliced out of the ``dd/mm/YYYY HH:MM`` text, which assumes the
+zero-padded format every Olist timestamp uses.
+"""
+import logging
+import os
+import sqlite3
+
+ENGINE = os.environ.get('OLIST_QUERY_ENGINE', 'pandas')
+
+logger = logging.getLogger(__name__)
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_closed_deals_seller ON closed_deals (seller_id, won_date, business_segment)",
+    "CREATE INDEX IF NOT EXISTS idx_sellers_seller ON sellers (seller_id, seller_city, seller_state)",
+    "CREATE INDEX IF NOT EXISTS idx_sellers_state ON sellers (seller_state, seller_id)",
+    "CREATE INDEX IF NOT EXISTS idx_order_2_status_seller ON order_2 (status, seller_id)",
+]
+
+# 'dd/mm/YYYY HH:MM' -> 'YYYY-MM'
+MONTH = "substr({0}, 7, 4) || '-' || substr({0}, 4, 2)"
+
+# Graph 1: one query per grouping, `{by}` being a column list such as
+# "seller_city, business_segment," (or empty for the overall counts)
+SQL_SELLER_MONTH_COUNTS = """
+SELECT {by} month, COUNT(DISTINCT seller_id) AS num_sellers
+FROM (
+    SELECT seller_id, seller_city, business_segment, """ + MONTH.format('won_date') + """ AS month
+    FROM sellers
+    NATURAL JOIN closed_deals
+    WHERE closed_deals.rowid BETWEEN :closed_deals_lo AND :closed_deals_hi
+      AND sellers.rowid BETWEEN :sellers_lo AND :sellers_hi
+)
+WHERE month BETWEEN :first_month AND :last_month {not_null}
+GROUP BY {by} month
+"""
+
+SQL_CITIES = """
+SELECT DISTINCT seller_city
+FROM sellers
+NATURAL JOIN closed_deals
+WHERE closed_deals.rowid <= :closed_deals_hi AND sellers.rowid <= :sellers_hi
+  AND seller_city IS NOT NULL
+ORDER BY seller_city
+"""
+
+SQL_SEGMENTS = """
+SELECT DISTINCT business_segment
+FROM sellers
+NATURAL JOIN closed_deals
+WHERE closed_deals.rowid <= :closed_deals_hi AND sellers.rowid <= :sellers_hi
+  AND business_segment IS NOT NULL
+ORDER BY business_segment
+"""
+
+# Graph 2
+SQL_MONTH_COUNTS = """
+SELECT business_segment, month, COUNT(*) AS segment_count
+FROM (
+    SELECT business_segment, """ + MONTH.format('won_date') + """ AS month
+    FROM closed_deals
+    WHERE rowid BETWEEN :closed_deals_lo AND :closed_deals_hi
+)
+WHERE month >= '2017-12-31' AND business_segment IS NOT NULL
+GROUP BY business_segment, month
+ORDER BY business_segment, month
+"""
+
+# Graph 3
+SQL_STATE_COUNTS = """
+SELECT seller_state,
+       SUM(is_new_seller) AS new_sellers,
+       COUNT(*) - SUM(is_new_seller) AS old_sellers
+FROM (
+    SELECT seller_state,
+           EXISTS (
+               SELECT 1 FROM closed_deals
+               WHERE closed_deals.seller_id = sellers.seller_id AND closed_deals.rowid <= :closed_deals_hi
+           ) AS is_new_seller
+    FROM sellers
+    WHERE rowid <= :sellers_hi AND seller_state IS NOT NULL
+)
+GROUP BY seller_state
+ORDER BY seller_state
+"""
+
+# Graph 4
+SQL_NEW_SELLER_ORDERS = """
+SELECT order_2.*, closed_deals.won_date
+FROM order_2
+JOIN closed_deals ON closed_deals.seller_id = order_2.seller_id
+WHERE order_2.status = 'delivered'
+  AND order_2.rowid BETWEEN :order_2_lo AND :order_2_hi
+  AND closed_deals.rowid <= :closed_deals_hi
+"""
+
+def enabled():
+    return ENGINE == 'sqlite'
+
+
+def ensure_indexes(db_path):
+    """Create the indexes the pushed-down queries use; returns False if the file is read-only."""
+    conn = sqlite3.connect(db_path)
+    try:
+        existing = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        missing = [statement for statement in INDEXES if statement.split()[5] not in existing]
+        if missing:
+            for statement in missing:
+                conn.execute(statement)
+            conn.execute("ANALYZE")
+            conn.commit()
+        return True
+    except sqlite3.OperationalError:
+        logger.warning("Could not create the query engine indexes on %s", db_path, exc_info=True)
+        return False
+    finally:
+        conn.close()
+
+
+def seller_month_counts(snap, by, months):
+    """Distinct sellers per month for a grouping of ``graph1.GROUPINGS``, as a Series."""
+    columns = [{'city': 'seller_city', 'segment': 'business_segment'}[key] for key in by]
+    sql = SQL_SELLER_MONTH_COUNTS.format(
+        by=''.join(f'{column}, ' for column in columns),
+        not_null=''.join(f' AND {column} IS NOT NULL' for column in columns),
+    )
+    params = {'first_month': months[0], 'last_month': months[-1]}
+    counts = snap.query(sql, params=params, label=f"seller_month_counts {'/'.join(by) or 'all'}")
+    counts.columns = list(by) + ['month', 'num_sellers']
+    return counts.set_index(list(by) + ['month'])['num_sellers']
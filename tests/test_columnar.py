@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import columnar
+
+
+def test_parse_dates_fixed_format():
+    values = pd.Series(['24/11/2017 13:05', '29/02/2016 00:00', '31/12/2018 23:59', '01/01/2017 00:00'], index=[3, 5, 7, 9])
+    parsed = columnar.parse_dates(values)
+    assert list(parsed.index) == [3, 5, 7, 9]
+    pd.testing.assert_series_equal(parsed, pd.to_datetime(values, format=columnar.DATE_FORMAT).astype('datetime64[ns]'))
+
+
+def test_parse_dates_matches_strptime():
+    rng = np.random.default_rng(0)
+    minutes = np.datetime64('2016-01-01T00:00') + rng.integers(0, 4 * 365 * 1440, 10_000).astype('timedelta64[m]')
+    values = pd.Series(pd.DatetimeIndex(minutes).strftime(columnar.DATE_FORMAT), dtype=object)
+    expected = pd.to_datetime(values, format=columnar.DATE_FORMAT)
+    assert (columnar.parse_dates(values) == expected).all()
+
+
+def test_missing_dates_are_nat():
+    parsed = columnar.parse_dates(np.array([columnar.MISSING_DATE, None, '24/11/2017 13:05'], dtype=object))
+    assert np.isnat(parsed[:2]).all()
+    assert parsed[2] == np.datetime64('2017-11-24T13:05')
+    days = columnar.parse_days([columnar.MISSING_DATE, '24/11/2017 13:05'])
+    assert list(days) == [columnar.NAT_DAY, columnar.day_number('2017-11-24')]
+
+
+def test_fallback_reads_iso_dates_year_first():
+    parsed = columnar.parse_dates(['2018-01-05 10:00:00', '2018-01-05', '2018-01-05T10:00', '24/11/2017 13:05'])
+    assert list(parsed) == [np.datetime64('2018-01-05T10:00'), np.datetime64('2018-01-05'),
+                            np.datetime64('2018-01-05T10:00'), np.datetime64('2017-11-24T13:05')]
+
+
+def test_fallback_reads_other_day_first_dates():
+    parsed = columnar.parse_dates(['5/1/2018 10:00', '05/01/2018', '05/01/2018 10:00:30'])
+    assert list(parsed) == [np.datetime64('2018-01-05T10:00'), np.datetime64('2018-01-05'),
+                            np.datetime64('2018-01-05T10:00:30')]
+
+
+@pytest.mark.parametrize('value', ['Jan 5 2018', '24/11/2017 13:05x', '2018/01/05', '31/02/2017 10:00'])
+def test_unreadable_dates_raise(value):
+    with pytest.raises(ValueError):
+        columnar.parse_dates(['24/11/2017 13:05', value])
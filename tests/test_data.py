@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cohorts
+import data
+import graph4
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import synthetic  # noqa: E402
+
+# Share of each table's rows in the database before the append
+FIRST_PART = 0.8
+
+
+@pytest.fixture(scope='session')
+def tables(tmp_path_factory):
+    """The rows of a small synthetic database, sellers shuffled so some get their deal after the append."""
+    path = str(tmp_path_factory.mktemp('synthetic') / 'olist.sqlite')
+    synthetic.generate(path, scale=0.1)
+    with sqlite3.connect(path) as conn:
+        frames = {table: pd.read_sql_query(f"SELECT * FROM {table}", conn) for table in data.TABLES}
+    frames['sellers'] = frames['sellers'].sample(frac=1, random_state=1).reset_index(drop=True)
+    return frames
+
+
+def _write(path, tables, part):
+    """Write the first (``part='first'``) or remaining rows of ``tables`` to ``path``."""
+    with sqlite3.connect(path) as conn:
+        for table, frame in tables.items():
+            cut = int(len(frame) * FIRST_PART)
+            rows = frame.iloc[:cut] if part == 'first' else frame.iloc[cut:]
+            rows.to_sql(table, conn, index=False, if_exists='append')
+    conn.close()
+
+
+@pytest.fixture
+def db_path(tmp_path, tables):
+    path = str(tmp_path / 'olist.sqlite')
+    _write(path, tables, 'first')
+    return path
+
+
+def _plain(frame, by):
+    """``frame`` with decoded categoricals and rows sorted by ``by``, for comparing.
+
+    Columns are copied to plain arrays, as frames loaded from the snapshot
+    cache hold ``np.memmap`` views.
+    """
+    frame = frame.astype({column: object for column in frame.columns if isinstance(frame[column].dtype, pd.CategoricalDtype)})
+    frame = frame.sort_values(by).reset_index(drop=True)
+    return pd.DataFrame({column: np.array(frame[column]) for column in frame.columns})
+
+
+def served(snap):
+    """What the callbacks read from ``snap``, as plain frames and arrays in a fixed order."""
+    outputs = {}
+    index = snap.get('graph1_index')
+    outputs['graph1 options'] = (index.cities, index.segments)
+    for city in [None] + index.cities:
+        for segment in [None] + index.segments:
+            outputs[f'graph1 {city} {segment}'] = index.get(city, segment)
+    outputs['month_counts'] = _plain(snap.get('month_counts'), ['business_segment', 'month'])
+    outputs['top_10_month_counts'] = _plain(snap.get('top_10_month_counts'), ['business_segment', 'month'])
+    outputs['state_summary'] = _plain(snap.get('state_summary'), ['seller_state'])
+    cube = snap.get('graph4_cube')
+    for month in graph4.CUT_OFF_MONTHS:
+        for age in graph4.SELLER_AGES:
+            found = cube.get(month, age)
+            outputs[f'graph4 {month} {age} totals'] = _plain(found.totals, ['seller_id', 'amount'])
+            outputs[f'graph4 {month} {age} trend'] = _plain(found.trend, ['seller_id', 'transaction_age_mark'])
+            outputs[f'graph4 {month} {age} bands'] = _plain(found.bands, ['transaction_age_mark'])
+            outputs[f'graph4 {month} {age} sellers'] = found.sellers.search(limit=len(found.sellers))
+    engine = snap.get('cohorts')
+    for width, horizon in cohorts.PRESETS.values():
+        matrix = engine.matrix(width, horizon)
+        outputs[f'cohorts {width} join_months'] = matrix.join_months
+        for measure in ('amount', 'orders', 'active_sellers', 'sellers'):
+            outputs[f'cohorts {width} {measure}'] = getattr(matrix, measure)
+    return outputs
+
+
+def assert_same(actual, expected, exact=True):
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, pd.DataFrame):
+            pd.testing.assert_frame_equal(actual[key], value, check_dtype=False, check_exact=exact, obj=key)
+        elif isinstance(value, np.ndarray):
+            if exact:
+                np.testing.assert_array_equal(actual[key], value, err_msg=key)
+            else:
+                np.testing.assert_allclose(actual[key], value, rtol=1e-9, err_msg=key)
+        else:
+            assert actual[key] == value, key
+
+
+def test_refresh_matches_full_build(db_path, tables):
+    snap = data.Snapshot(db_path).warm()
+    _write(db_path, tables, 'rest')
+
+    refreshed = snap.refresh()
+    assert refreshed is not snap
+    assert refreshed.watermarks == data.read_watermarks(db_path)
+    # Sums are added up in another order than in a full build
+    assert_same(served(refreshed), served(data.Snapshot(db_path).warm()), exact=False)
+    assert refreshed.refresh() is refreshed
+
+
+@pytest.fixture
+def snapshot_cache(monkeypatch, tmp_path, db_path):
+    """Point the module-level snapshot at ``db_path`` with a snapshot cache in ``tmp_path``."""
+    monkeypatch.setattr(data, 'DB_PATH', db_path)
+    monkeypatch.setattr(data, 'SNAPSHOT_DIR', str(tmp_path / 'snapshot_cache'))
+    monkeypatch.setattr(data, '_current', None)
+    return data.SNAPSHOT_DIR
+
+
+def test_reload_from_snapshot_cache(monkeypatch, snapshot_cache):
+    built = data.warm()
+    expected = served(built)
+
+    # A new process: the cache entry matches the database, so nothing is built
+    monkeypatch.setattr(data, '_current', None)
+    loaded = data.current()
+    assert loaded.persisted
+    assert loaded.watermarks == built.watermarks
+    assert_same(served(loaded.warm()), expected)
+
+
+def test_snapshot_cache_after_append(monkeypatch, snapshot_cache, db_path, tables):
+    data.warm()
+    _write(db_path, tables, 'rest')
+
+    refreshed = data.refresh()
+    assert refreshed.persisted
+    full = served(data.Snapshot(db_path).warm())
+    assert_same(served(refreshed), full, exact=False)
+
+    # The entry written by the refresh serves the next process
+    monkeypatch.setattr(data, '_current', None)
+    loaded = data.current()
+    assert loaded.persisted
+    assert loaded.watermarks == data.read_watermarks(db_path)
+    assert_same(served(loaded.warm()), served(refreshed))